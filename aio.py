@@ -0,0 +1,62 @@
+"""
+Bounded pools for the async views (search, category and product pages,
+login and image resizes). The views render their templates on the database
+pool too, since the layout's cart and category lookups may query SQLite.
+
+Awaiting run_db() or run_cpu() hands a blocking call to a thread pool, so
+it never stalls the event loop the view runs on, and SQLite sees at most
+DB_WORKERS connections however many requests are in flight. Calls run in a
+copy of the caller's context, so Flask's request, session and g work as
+usual inside them. Under a WSGI server each async view gets its own short
+event loop and behaves like a synchronous one with the same limits; see
+asgi.py for the ASGI mode.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DB_WORKERS = int(os.environ.get('STORE_DB_WORKERS', 0)) or min(32, (os.cpu_count() or 1) * 4)
+# Pillow releases the GIL while decoding, resizing and encoding, so image
+# work scales on threads.
+CPU_WORKERS = int(os.environ.get('STORE_CPU_WORKERS', 0)) or os.cpu_count() or 1
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def configure(db_workers=None, cpu_workers=None):
+    """Resize the pools (for benchmarks); calls already running finish on the old ones."""
+    global DB_WORKERS, CPU_WORKERS
+    with _executors_lock:
+        for name, workers in (('db', db_workers), ('cpu', cpu_workers)):
+            if workers is None:
+                continue
+            if name == 'db':
+                DB_WORKERS = workers
+            else:
+                CPU_WORKERS = workers
+            executor = _executors.pop(name, None)
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+def _get_executor(name):
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            workers = DB_WORKERS if name == 'db' else CPU_WORKERS
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        return executor
+
+async def _run(name, func, args, kwargs):
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(name), call)
+
+async def run_db(func, *args, **kwargs):
+    """Await func(*args, **kwargs) on the database pool."""
+    return await _run('db', func, args, kwargs)
+
+async def run_cpu(func, *args, **kwargs):
+    """Await func(*args, **kwargs) on the pool for CPU-bound work such as image resizing."""
+    return await _run('cpu', func, args, kwargs)
@@ -1,24 +1,50 @@
-from flask import Flask, render_template, session, redirect, url_for, flash, request, abort
+from flask import Flask, Response, render_template, session, redirect, url_for, flash, request, abort, jsonify, send_file, make_response, g
 from decimal import Decimal
+import click
+import csv
+import aio
+import assets
+import catalog
 import database
+import hashlib
+import io
+import json
 import os
-from werkzeug.utils import secure_filename
-from PIL import Image
-import time
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+import images
+import importer
+import page_cache
+import passwords
+import profiling
+import secrets
+import zlib
+from datetime import datetime, timezone
+from urllib.error import URLError
+from urllib.request import urlopen
+from werkzeug.http import is_resource_modified
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 
+# Opt-in in-memory catalog for browse queries (STORE_CATALOG_SNAPSHOT=1)
+catalog.init_app(app)
+
+# Opt-in instrumentation (STORE_PROFILING=1); must wrap database before first use
+profiling.init_app(app)
+
 # Initialize the database
 database.init_db()
 
+# Fingerprinted static URLs, once 'flask build-assets' has been run
+assets.init_app(app)
+
 UPLOAD_FOLDER = 'static/images/products'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Feed image paths given to /admin/import are relative to this directory
+app.config['IMPORT_IMAGES_DIR'] = 'imports/images'
+IMPORT_CHECKPOINT_DIR = 'imports'
 
 def datetimeformat(value, format='%Y-%m-%d %H:%M:%S'):
     """Format a datetime object or timestamp string"""
@@ -42,45 +68,160 @@ app.jinja_env.filters['datetimeformat'] = datetimeformat
 def inject_template_vars():
     """Inject common variables into all templates"""
     return {
-        'get_categories_for_nav': lambda: database.get_categories(),
+        'get_categories_for_nav': database.get_categories,
+        'cart_summary': cart_summary,
         'now': datetime.now()
     }
 
+EMPTY_CART = {'lines': 0, 'units': 0, 'total': 0}
+
+def cart_token(create=False):
+    """Token of the visitor's server-side cart; the session holds nothing else of it"""
+    token = session.get('cart_token')
+    if token is None and create:
+        token = session['cart_token'] = secrets.token_urlsafe(16)
+    return token
+
+def cart_summary():
+    """
+    Lines, units and total of the visitor's cart, queried at most once per
+    request. Async views render on the database pool (aio.run_db), so the
+    layout does not query SQLite on the event loop.
+    """
+    if 'cart_summary' not in g:
+        token = cart_token()
+        g.cart_summary = database.get_cart_summary(token) if token else EMPTY_CART
+    return g.cart_summary
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_image(image_file):
-    # Open the image
-    img = Image.open(image_file)
-    
-    # Convert to RGB if necessary
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    
-    # Resize if too large while maintaining aspect ratio
-    max_size = (800, 800)
-    img.thumbnail(max_size, Image.LANCZOS)
-    
-    # Generate unique filename
-    original_filename = secure_filename(image_file.filename)
-    filename = f"{os.path.splitext(original_filename)[0]}_{int(time.time())}.jpg"
-    
-    # Save the processed image
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    img.save(save_path, 'JPEG', quality=85)
-    
-    return filename
+def product_image_url(product, size='detail', ext='jpg'):
+    """URL of a product image rendition, or of the stored image until it is ready"""
+    if size in (product.get('image_renditions') or '').split(','):
+        stem = os.path.splitext(product['image'])[0]
+        filename = images.rendition_filename(stem, size, ext)
+    else:
+        filename = product['image']
+    return url_for('static', filename='images/products/' + filename)
+
+app.jinja_env.globals['product_image_url'] = product_image_url
+
+IMAGE_MAX_AGE = 30 * 24 * 3600
+
+@app.route('/img/<path:filename>')
+async def resized_product_image(filename):
+    """Product image resized on first request (?w=<px>&format=jpg|webp)"""
+    width = request.args.get('w', 400, type=int)
+    ext = request.args.get('format', 'jpg')
+    if ext not in images.RESIZE_MIMETYPES or width <= 0:
+        abort(404)
+    result = await aio.run_cpu(images.resized_image, app.config['UPLOAD_FOLDER'], filename, width, ext)
+    if result is None:
+        abort(404)
+    path, etag = result
+    return send_file(path, mimetype=images.RESIZE_MIMETYPES[ext], etag=etag,
+                     max_age=IMAGE_MAX_AGE, conditional=True)
+
+def _deployment_salt():
+    """Digest of the code, templates and asset URLs, so a deploy invalidates every page ETag"""
+    digest = hashlib.sha1(assets.manifest_digest().encode())
+    for root, dirs, files in os.walk(app.root_path):
+        # Only the modules at the top and the templates; static/ and the
+        # caches hold generated files and are large
+        if root == app.root_path:
+            dirs[:] = [name for name in dirs if name == 'templates']
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(('.py', '.html')):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f"{name}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return digest.hexdigest()
+
+DEPLOYMENT_SALT = _deployment_salt()
+
+ANONYMOUS_VIEWER = (None, None, None, 0)
+
+def _viewer():
+    """Everything base.html shows that depends on the visitor"""
+    return (session.get('user_id'), session.get('user_email'), session.get('is_admin'),
+            cart_summary()['lines'])
+
+def page_validators(*scopes):
+    """
+    (ETag, Last-Modified) of a catalog page built from the given change
+    stamp scopes, or None when the page has to be rendered anyway.
+    """
+    if session.get('_flashes'):
+        # Rendering the page is what consumes the flashed messages
+        return None
+    stamps = database.get_change_stamps(('categories',) + scopes)
+    viewer = _viewer()
+    etag = hashlib.sha1(
+        repr((DEPLOYMENT_SALT, stamps['versions'], viewer, datetime.now().year)).encode()
+    ).hexdigest()
+    # A date cannot express a login or a cart change, so only anonymous
+    # visitors with an empty cart get one; everyone else relies on the ETag.
+    last_modified = None
+    if viewer == ANONYMOUS_VIEWER:
+        last_modified = datetime.fromtimestamp(stamps['last_modified'], timezone.utc)
+    return etag, last_modified
+
+def with_validators(response, validators):
+    if validators is not None:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Personalised, so browsers may keep it but must revalidate each time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+def not_modified(validators):
+    """A 304 response if the client's copy still matches, otherwise None"""
+    if validators is None or is_resource_modified(request.environ, etag=validators[0],
+                                                  last_modified=validators[1]):
+        return None
+    return with_validators(app.response_class(status=304), validators)
+
+def _page_cache_key(validators):
+    """Page cache key for this request, or None if it must not be cached"""
+    if validators is None or _viewer() != ANONYMOUS_VIEWER:
+        return None
+    return page_cache.make_key(request.endpoint, request.path, request.args)
+
+def cached_page(validators):
+    """A 304 or a cached copy of this catalog page, otherwise None"""
+    response = not_modified(validators)
+    if response is None:
+        key = _page_cache_key(validators)
+        body = page_cache.get(key, validators[0]) if key else None
+        if body is not None:
+            response = with_validators(make_response(body), validators)
+    return response
+
+def page_response(body, validators, tags=()):
+    """Response for a freshly rendered catalog page, cached for anonymous visitors"""
+    body = body.encode()
+    key = _page_cache_key(validators)
+    if key:
+        page_cache.put(key, validators[0], body, tags)
+    return with_validators(make_response(body), validators)
 
 @app.route('/')
 def home():
-    if 'cart' not in session:
-        session['cart'] = {}
+    validators = page_validators('catalog')
+    response = cached_page(validators)
+    if response is not None:
+        return response
     featured_products = database.get_featured_products()
-    return render_template('home.html', featured_products=featured_products)
+    return page_response(render_template('home.html', featured_products=featured_products),
+                         validators, tags=['catalog'])
 
 @app.route('/<category>')
-def category_page(category):
+async def category_page(category):
     # Get filter/sort params from query string
     sort = request.args.get('sort', 'newest')
     brands = request.args.getlist('brand')
@@ -89,21 +230,36 @@ def category_page(category):
     # Convert price_min/max to float if present
     price_min = float(price_min) if price_min else None
     price_max = float(price_max) if price_max else None
-    # Fetch all brands for this category for the filter UI
-    all_brands = database.get_brands_for_category(category)
-    # Fetch filtered/sorted products
-    products = database.get_products_by_category(
+    category_row = await aio.run_db(database.get_category_by_slug, category)
+    validators = await aio.run_db(page_validators, f"category:{category_row['id']}") if category_row else None
+    response = cached_page(validators)
+    if response is not None:
+        return response
+    # Fetch filtered/sorted products and the filter UI facets in one go
+    listing = await aio.run_db(
+        database.get_category_listing,
         category_slug=category,
         brands=brands if brands else None,
         price_min=price_min,
         price_max=price_max,
-        sort=sort
+        sort=sort,
+        cursor=request.args.get('cursor')
     )
-    if products is not None:
-        return render_template('category.html', 
+    if listing is not None:
+        # Only what the page cache key covers, since the page may be cached
+        args = page_cache.cached_args('category_page', request.args)
+        cursor = args.pop('cursor', None)
+        next_url = None
+        if listing['next_cursor']:
+            next_url = url_for('category_page', category=category, cursor=listing['next_cursor'], **args)
+        return page_response(await aio.run_db(render_template, 'category.html', 
                              category=category, 
-                             products=products,
-                             brands=all_brands)
+                             products=listing['products'],
+                             facets=listing['facets'],
+                             next_url=next_url,
+                             first_url=url_for('category_page', category=category, **args) if cursor else None),
+                             validators,
+                             tags=[f"category:{category_row['id']}"] + [f"product:{p['id']}" for p in listing['products']])
     return "Category not found", 404
 
 @app.route('/checkout', methods=['GET', 'POST'])
@@ -113,8 +269,9 @@ def checkout():
         flash('Musisz być zalogowany, aby złożyć zamówienie.', 'danger')
         return redirect(url_for('login', next=url_for('checkout')))
     # Require cart
-    cart = session.get('cart', {})
-    total = sum(item['price'] * item['quantity'] for item in cart.values())
+    token = cart_token()
+    cart = database.get_cart(token) if token else []
+    total = sum(item['price'] * item['quantity'] for item in cart)
     user = database.get_user_by_id(session['user_id'])
     if request.method == 'POST':
         full_name = request.form.get('full_name', '').strip()
@@ -134,11 +291,10 @@ def checkout():
                 user_id=session['user_id'],
                 full_name=full_name,
                 address=address,
-                cart=cart,
-                total=total
+                cart_token=token
             )
-            session['cart'] = {}
-            session.modified = True
+            # Stock levels changed
+            page_cache.invalidate('catalog', *(f"product:{item['product_id']}" for item in cart))
             flash('Zamówienie zostało złożone pomyślnie!', 'success')
             return redirect(url_for('order_confirmation', order_id=order_id))
         except Exception as e:
@@ -155,36 +311,16 @@ def order_history():
     if 'user_id' not in session:
         flash('Musisz być zalogowany, aby zobaczyć historię zamówień.', 'danger')
         return redirect(url_for('login', next=url_for('order_history')))
-    orders = database.get_orders_for_user(session['user_id'])
-    # Attach items to each order
-    for order in orders:
-        order['items'] = database.get_order_items(order['id'])
-    return render_template('order_history.html', orders=orders)
+    orders, page, has_next = database.get_orders_with_items_for_user(session['user_id'],
+                                                                     page=request.args.get('page', 1, type=int))
+    return render_template('order_history.html', orders=orders, page=page, has_next=has_next)
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
-    product_name = request.form.get('product_name')
+    product_id = request.form.get('product_id', type=int)
+    quantity = max(request.form.get('quantity', 1, type=int), 1)
     
-    if 'cart' not in session:
-        session['cart'] = {}
-    
-    product = database.get_product_by_name(product_name)
-    
-    if product:
-        cart_item = {
-            'name': product['name'],
-            'price': product['price'],
-            'image': product['image'],
-            'category': product['category'],
-            'quantity': 1
-        }
-        
-        if product_name in session['cart']:
-            session['cart'][product_name]['quantity'] += 1
-        else:
-            session['cart'][product_name] = cart_item
-        
-        session.modified = True
+    if product_id and database.add_to_cart(cart_token(create=True), product_id, quantity):
         flash('Produkt dodany do koszyka!', 'success')
     
     # Redirect back to referring page, or home if not available
@@ -193,31 +329,27 @@ def add_to_cart():
 
 @app.route('/cart')
 def view_cart():
-    if 'cart' not in session:
-        session['cart'] = {}
-    
-    total = sum(item['price'] * item['quantity'] for item in session['cart'].values())
-    return render_template('cart.html', cart=session['cart'], total=total)
-
-@app.route('/remove_from_cart/<product_name>')
-def remove_from_cart(product_name):
-    if product_name in session['cart']:
-        del session['cart'][product_name]
-        session.modified = True
+    token = cart_token()
+    cart = database.get_cart(token) if token else []
+    total = sum(item['price'] * item['quantity'] for item in cart)
+    return render_template('cart.html', cart=cart, total=total)
+
+@app.route('/remove_from_cart/<int:product_id>')
+def remove_from_cart(product_id):
+    token = cart_token()
+    if token:
+        database.remove_from_cart(token, product_id)
         flash('Produkt usunięty z koszyka!', 'success')
     return redirect(url_for('view_cart'))
 
 @app.route('/update_quantity', methods=['POST'])
 def update_quantity():
-    product_name = request.form.get('product_name')
-    quantity = int(request.form.get('quantity'))
+    product_id = request.form.get('product_id', type=int)
+    quantity = request.form.get('quantity', 0, type=int)
     
-    if product_name in session['cart']:
-        if quantity > 0:
-            session['cart'][product_name]['quantity'] = quantity
-        else:
-            del session['cart'][product_name]
-        session.modified = True
+    token = cart_token()
+    if token and product_id:
+        database.set_cart_quantity(token, product_id, quantity)
     
     return redirect(url_for('view_cart'))
 
@@ -243,8 +375,12 @@ def add_product():
             return redirect(request.url)
         
         try:
-            filename = process_image(image)
-            database.add_product(name, float(price), description, filename, category)
+            upload_folder = app.config['UPLOAD_FOLDER']
+            filename, stem = images.save_upload(image, upload_folder)
+            product_id = database.add_product(name, float(price), description, filename, category)
+            if product_id:
+                images.queue_renditions(product_id, upload_folder, filename, stem)
+                page_cache.invalidate('catalog', f"category:{database.get_category_by_slug(category)['id']}")
             flash('Produkt został dodany pomyślnie')
             return redirect(url_for('category_page', category=category))
         except Exception as e:
@@ -254,6 +390,45 @@ def add_product():
     categories = database.get_categories()
     return render_template('admin/add_product.html', categories=categories)
 
+@app.route('/admin/import', methods=['GET', 'POST'])
+def admin_import():
+    """Bulk product import from an uploaded CSV/JSONL feed (see importer.py)"""
+    if not session.get('is_admin'):
+        flash('Brak dostępu.', 'danger')
+        return redirect(url_for('home'))
+    report = None
+    if request.method == 'POST':
+        feed = request.files.get('feed')
+        if not feed or not feed.filename:
+            flash('Wybierz plik do importu.', 'danger')
+            return redirect(request.url)
+        # Uploading the same file again after a failure resumes it; the
+        # checkpoint is keyed by content, so another feed never inherits it
+        feed_digest = hashlib.sha256()
+        for chunk in iter(lambda: feed.stream.read(1024 * 1024), b''):
+            feed_digest.update(chunk)
+        feed.stream.seek(0)
+        os.makedirs(IMPORT_CHECKPOINT_DIR, exist_ok=True)
+        checkpoint_path = os.path.join(IMPORT_CHECKPOINT_DIR, feed_digest.hexdigest() + '.checkpoint')
+        if request.form.get('restart') and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        try:
+            report = importer.import_feed(
+                feed.stream,
+                request.form.get('format') or importer.feed_format(feed.filename),
+                images_dir=app.config['IMPORT_IMAGES_DIR'],
+                upload_folder=app.config['UPLOAD_FOLDER'],
+                checkpoint_path=checkpoint_path,
+                # Renditions finish in the background, as for add_product
+                wait_for_images=False
+            )
+            flash(f"Import zakończony: {report['created']} nowych, {report['updated']} zaktualizowanych, "
+                  f"{report['failed']} błędów.", 'success' if not report['failed'] else 'warning')
+        except Exception as e:
+            flash(f'Import przerwany: {e}. Wyślij plik ponownie, aby wznowić.', 'danger')
+        page_cache.clear()
+    return render_template('admin/import.html', report=report)
+
 @app.route('/debug/products')
 def debug_products():
     products = database.get_all_products()
@@ -277,7 +452,11 @@ def register():
             flash('Hasła nie są identyczne!', 'danger')
             return redirect(url_for('register'))
 
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = passwords.hash_password(password)
+        except Exception as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('register'))
         
         if database.create_user(email, hashed_password, full_name, ""):
             flash('Rejestracja pomyślna! Możesz się teraz zalogować.', 'success')
@@ -289,7 +468,7 @@ def register():
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
-def login():
+async def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
@@ -298,9 +477,16 @@ def login():
             flash('Email i hasło są wymagane!', 'danger')
             return redirect(url_for('login'))
 
-        user = database.get_user_by_email(email)
+        user = await aio.run_db(database.get_user_by_email, email)
+
+        try:
+            valid = user is not None and await passwords.verify_password_async(user['password_hash'], password)
+        except Exception as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('login'))
 
-        if user and check_password_hash(user['password_hash'], password):
+        if valid:
+            passwords.rehash_in_background(user, password)
             session['user_id'] = user['id']
             session['user_email'] = user['email']
             session['is_admin'] = user['is_admin']
@@ -310,7 +496,7 @@ def login():
             flash('Nieprawidłowy email lub hasło.', 'danger')
             return redirect(url_for('login'))
 
-    return render_template('login.html')
+    return await aio.run_db(render_template, 'login.html')
 
 @app.route('/logout')
 def logout():
@@ -321,46 +507,50 @@ def logout():
     return redirect(url_for('home'))
 
 @app.route('/search')
-def search():
+async def search():
     """Handle product search"""
     query = request.args.get('q', '').strip()
     if not query:
         return redirect(url_for('home'))
     
-    products = database.search_products(query)
-    return render_template('search_results.html', 
+    page = request.args.get('page', 1, type=int)
+    products, total = await aio.run_db(database.search_products, query, page=page)
+    page = database.search_page(page, total)
+    page_count = -(-total // database.SEARCH_PAGE_SIZE)
+    return await aio.run_db(render_template, 'search_results.html', 
                          products=products, 
                          search_query=query,
-                         result_count=len(products))
+                         result_count=total,
+                         page=page,
+                         page_count=page_count)
 
 @app.route('/product/<path:product_identifier>')
-def product_detail(product_identifier):
+async def product_detail(product_identifier):
     """Display product details and reviews"""
-    print(f"Looking for product with identifier: {product_identifier}")
-    product = database.get_product_by_id_or_slug(product_identifier)
-    print(f"Found product: {product}")
-    
+    product = await aio.run_db(database.get_product_by_id_or_slug, product_identifier)
     if not product:
-        print(f"Product not found for identifier: {product_identifier}")
         abort(404)
+    validators = await aio.run_db(page_validators, f"product:{product['id']}")
+    response = cached_page(validators)
+    if response is not None:
+        return response
     
-    # Get product reviews
-    reviews = database.get_product_reviews(product['id'])
-    print(f"Found {len(reviews)} reviews for product {product['id']}")
-    
-    # Calculate average rating
-    avg_rating = 0
-    if reviews:
-        avg_rating = sum(review['rating'] for review in reviews) / len(reviews)
+    # Get the rating summary and one page of reviews
+    rating = await aio.run_db(database.get_rating_summary, product['id'])
+    reviews_page_count = -(-rating['count'] // database.REVIEWS_PAGE_SIZE)
+    reviews_page = min(max(request.args.get('reviews_page', 1, type=int), 1), max(reviews_page_count, 1))
+    reviews = await aio.run_db(database.get_product_reviews, product['id'], page=reviews_page)
     
-    # Debug output
-    print(f"Rendering template with product: {product['name']}, price: {product['price']}, image: {product['image']}")
-    
-    return render_template('product_detail.html', 
+    return page_response(await aio.run_db(render_template, 'product_detail.html', 
                          product=product, 
                          reviews=reviews,
-                         avg_rating=round(avg_rating, 1) if reviews else 0,
-                         review_count=len(reviews))
+                         avg_rating=rating['average'],
+                         review_count=rating['count'],
+                         rating_histogram=rating['histogram'],
+                         reviews_page=reviews_page,
+                         reviews_page_count=reviews_page_count),
+                         validators,
+                         tags=[f"product:{product['id']}"])
 
 @app.route('/product/<int:product_id>/review', methods=['POST'])
 def submit_review(product_id):
@@ -388,6 +578,7 @@ def submit_review(product_id):
         rating=int(rating),
         comment=comment
     ):
+        page_cache.invalidate(f"product:{product_id}")
         flash('Dziękujemy za dodanie opinii!', 'success')
     else:
         flash('Wystąpił błąd podczas dodawania opinii. Spróbuj ponownie później.', 'danger')
@@ -403,8 +594,140 @@ def admin_orders():
     if not session.get('is_admin'):
         flash('Brak dostępu. Tylko administratorzy mogą przeglądać zamówienia.', 'danger')
         return redirect(url_for('home'))
-    orders = database.get_all_orders_with_users()
-    return render_template('admin/orders.html', orders=orders)
+    filters = {
+        'status': request.args.get('status', '').strip(),
+        'date_from': request.args.get('date_from', '').strip(),
+        'date_to': request.args.get('date_to', '').strip(),
+        'email': request.args.get('email', '').strip(),
+    }
+    orders, next_cursor = database.get_orders_page(
+        cursor=request.args.get('cursor'),
+        status=filters['status'] or None,
+        date_from=filters['date_from'] or None,
+        date_to=filters['date_to'] or None,
+        user_email=filters['email'] or None
+    )
+    return render_template('admin/orders.html', orders=orders, filters=filters,
+                           next_cursor=next_cursor, is_first_page=not request.args.get('cursor'))
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+def _export_chunks(batches, fmt):
+    """Text of an order export, one chunk per batch of rows"""
+    columns = database.ORDER_EXPORT_COLUMNS
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for rows in batches:
+            yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+@app.route('/admin/export/orders')
+def admin_export_orders():
+    """Stream orders with their items as CSV or JSONL (?format=csv|jsonl&status=&date_from=&date_to=&gzip=1)"""
+    if not session.get('is_admin'):
+        abort(403)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    date_from = request.args.get('date_from', '').strip()
+    date_to = request.args.get('date_to', '').strip()
+    compress = request.args.get('gzip') == '1'
+    batches = database.iter_order_export(
+        status=request.args.get('status', '').strip() or None,
+        date_from=date_from or None,
+        date_to=date_to or None
+    )
+
+    def generate():
+        # wbits=31 makes zlib write a gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        for chunk in _export_chunks(batches, fmt):
+            data = chunk.encode('utf-8')
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor is not None:
+            yield compressor.flush()
+
+    filename = f"zamowienia_{date_from or 'poczatek'}_{date_to or 'dzis'}.{fmt}" + ('.gz' if compress else '')
+    return Response(generate(), mimetype='application/gzip' if compress else EXPORT_MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/admin/stats')
+def admin_stats():
+    if not session.get('is_admin'):
+        abort(403)
+    return jsonify({
+        'db_pool': database.get_pool_stats(),
+        'category_cache': database.get_category_cache_stats(),
+        'page_cache': page_cache.get_stats(),
+        'catalog_snapshot': catalog.get_stats() if catalog.ENABLED else None,
+    })
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    if not session.get('is_admin'):
+        flash('Brak dostępu.', 'danger')
+        return redirect(url_for('home'))
+    days = min(max(request.args.get('days', database.ANALYTICS_DAYS, type=int), 1), 366)
+    analytics = database.get_sales_analytics(days=days)
+    return render_template('admin/analytics.html', analytics=analytics, days=days)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the sales rollups from the full order history."""
+    with database.get_db() as db:
+        db.execute('BEGIN IMMEDIATE')
+        database.rebuild_sales_rollups(db)
+        db.commit()
+    click.echo("Sales rollups rebuilt.")
+
+@app.cli.command('purge-carts')
+@click.option('--days', default=database.CART_MAX_AGE_DAYS, show_default=True,
+              help='Delete carts not touched for this many days.')
+def purge_carts_command(days):
+    """Delete abandoned carts (run it from cron)."""
+    with database.get_db() as db:
+        database.purge_stale_carts(db, days)
+        db.commit()
+    click.echo("Stale carts deleted.")
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete earlier builds first (pages cached by browsers may still use them).')
+def build_assets_command(clean):
+    """Fingerprint and precompress the static files; restart the app to use them."""
+    manifest = assets.build(app.static_folder, clean=clean)
+    click.echo(f"{len(manifest['assets'])} files, {len(manifest['encodings'])} precompressed"
+               f"{'' if assets.brotli else ' (gzip only: brotli is not installed)'}.")
+
+@app.cli.command('warm-cache')
+@click.option('--server', default='http://127.0.0.1:5000', show_default=True, help='Base URL of the running store.')
+@click.option('--products', default=200, show_default=True, help='How many best-selling product pages to request.')
+@click.option('--rounds', default=1, show_default=True,
+              help='Passes over the pages; with several worker processes each request only warms the one serving it.')
+def warm_cache_command(server, products, rounds):
+    """Fill the page cache of a running store with its top catalog pages."""
+    paths = ['/'] + [f"/{category['slug']}" for category in database.get_categories()]
+    paths += [f"/product/{product['slug'] or product['id']}" for product in database.get_top_products(products)]
+    failed = 0
+    for _ in range(rounds):
+        for path in paths:
+            try:
+                with urlopen(server.rstrip('/') + path) as response:
+                    response.read()
+            except (URLError, OSError) as e:
+                failed += 1
+                click.echo(f"{path}: {e}", err=True)
+    click.echo(f"Requested {len(paths)} pages x {rounds}, {failed} failed.")
 
 @app.route('/admin/users')
 def admin_users():
@@ -416,7 +739,6 @@ def admin_users():
 
 @app.route('/admin/users/<int:user_id>/edit', methods=['GET', 'POST'])
 def admin_edit_user(user_id):
-    from werkzeug.security import generate_password_hash
     if not session.get('is_admin'):
         flash('Brak dostępu.', 'danger')
         return redirect(url_for('home'))
@@ -444,7 +766,7 @@ def admin_edit_user(user_id):
                     db.execute('UPDATE users SET is_admin = ? WHERE id = ?', (is_admin, user_id))
                     db.commit()
                 if new_password:
-                    database.update_user_password(user_id, generate_password_hash(new_password))
+                    database.update_user_password(user_id, passwords.hash_password(new_password))
                 flash('Dane użytkownika zostały zaktualizowane.', 'success')
                 return redirect(url_for('admin_users'))
             except Exception as e:
@@ -483,7 +805,6 @@ def admin_order_detail(order_id):
 
 @app.route('/account', methods=['GET', 'POST'])
 def account():
-    from werkzeug.security import check_password_hash, generate_password_hash
     if 'user_id' not in session:
         flash('Musisz być zalogowany, aby zobaczyć swoje konto.', 'danger')
         return redirect(url_for('login'))
@@ -494,19 +815,23 @@ def account():
             current_password = request.form.get('current_password', '')
             new_password = request.form.get('new_password', '')
             confirm_password = request.form.get('confirm_password', '')
-            if not current_password or not new_password or not confirm_password:
-                flash('Wszystkie pola są wymagane.', 'danger')
-            elif not check_password_hash(user['password_hash'], current_password):
-                flash('Aktualne hasło jest nieprawidłowe.', 'danger')
-            elif new_password != confirm_password:
-                flash('Nowe hasła nie są zgodne.', 'danger')
-            elif len(new_password) < 6:
-                flash('Nowe hasło musi mieć przynajmniej 6 znaków.', 'danger')
-            else:
-                new_hash = generate_password_hash(new_password)
-                database.update_user_password(session['user_id'], new_hash)
-                flash('Hasło zostało zmienione.', 'success')
-                return redirect(url_for('account'))
+            try:
+                if not current_password or not new_password or not confirm_password:
+                    flash('Wszystkie pola są wymagane.', 'danger')
+                elif not passwords.verify_password(user['password_hash'], current_password):
+                    flash('Aktualne hasło jest nieprawidłowe.', 'danger')
+                elif new_password != confirm_password:
+                    flash('Nowe hasła nie są zgodne.', 'danger')
+                elif len(new_password) < 6:
+                    flash('Nowe hasło musi mieć przynajmniej 6 znaków.', 'danger')
+                else:
+                    new_hash = passwords.hash_password(new_password)
+                    database.update_user_password(session['user_id'], new_hash)
+                    flash('Hasło zostało zmienione.', 'success')
+                    return redirect(url_for('account'))
+            except Exception as e:
+                # The hashing pool is full
+                flash(str(e), 'danger')
         # Account info form
         else:
             full_name = request.form.get('full_name', '').strip()
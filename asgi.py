@@ -0,0 +1,60 @@
+"""
+ASGI entry point, the async serving mode:
+
+    uvicorn asgi:application --workers 4
+
+The server's event loop reads requests and writes responses, so slow
+clients and idle keep-alive connections cost no thread. The Flask code of
+each request runs on one of REQUEST_WORKERS threads; the async views run
+their coroutines on the event loop and await SQLite, template rendering and
+image work on the pools in aio.py. The synchronous views run entirely on
+their request thread. Size REQUEST_WORKERS for requests in flight and
+STORE_DB_WORKERS for what SQLite should see at once.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app
+
+REQUEST_WORKERS = int(os.environ.get('STORE_REQUEST_WORKERS', 0)) or 64
+
+_request_executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix='request')
+
+class _RequestInstance(WsgiToAsgiInstance):
+    # asgiref runs the WSGI app "thread-sensitively": every request on one
+    # shared thread, and once an async view has nested async_to_sync calls,
+    # on an executor that has already quit. Run it on our own pool instead.
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run_wsgi_app, thread_sensitive=False, executor=_request_executor)(body)
+
+    def _run_wsgi_app(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # Too many duplicate headers
+            self.start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            result = [b'Bad Request']
+        else:
+            result = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in result:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+class _FlaskToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _RequestInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+application = _FlaskToAsgi(app)
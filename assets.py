@@ -0,0 +1,142 @@
+"""
+Fingerprinted, precompressed static files.
+
+    flask build-assets
+
+copies every file under static/ to static/dist/ with a digest of its
+content in the name (css/style.css -> dist/css/style.<digest>.css), writes
+gzip and, when the brotli package is installed, brotli variants of the
+text files next to each copy, and records the mapping in
+static/dist/manifest.json.
+
+With a manifest present, url_for('static', filename=...) emits the
+fingerprinted URL. Fingerprinted files are served with a year-long
+immutable Cache-Control and the best precompressed variant the client
+accepts; anything not in the manifest (such as product images uploaded
+after the build) is served as before. Old fingerprinted files are left in
+place so pages cached before a rebuild keep working. A front-end server
+can serve static/dist/ directly (nginx: gzip_static / brotli_static).
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DIGEST_LENGTH = 12
+# Only text formats are worth compressing; images are compressed already.
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map', '.ico'}
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+_manifest = {'assets': {}, 'encodings': {}}
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output identical between builds
+    return gzip.compress(data, 9, mtime=0)
+
+def build(static_folder, clean=False):
+    """Fingerprint and precompress everything under static_folder. Returns the manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    if clean and os.path.isdir(dist):
+        shutil.rmtree(dist)
+    manifest = {'assets': {}, 'encodings': {}}
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(filename)
+            digest = hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+            hashed = f"{DIST_DIR}/{stem}.{digest}{ext}"
+            target = os.path.join(static_folder, hashed)
+            manifest['assets'][filename] = hashed
+            if not os.path.exists(target):
+                # A copy, never a link: editing the source must not change a
+                # file browsers were told never to revalidate
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(target + '.tmp', target)
+            if ext.lower() not in COMPRESSIBLE:
+                continue
+            encodings = []
+            for encoding, suffix in ENCODINGS.items():
+                if encoding == 'br' and brotli is None:
+                    continue
+                compressed = _compress(data, encoding)
+                if len(compressed) < len(data):
+                    with open(target + suffix, 'wb') as f:
+                        f.write(compressed)
+                    encodings.append(encoding)
+            if encodings:
+                manifest['encodings'][hashed] = encodings
+    os.makedirs(dist, exist_ok=True)
+    tmp_path = os.path.join(dist, MANIFEST + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(dist, MANIFEST))
+    return manifest
+
+def load_manifest(static_folder):
+    """Use the manifest in static_folder, if one has been built."""
+    global _manifest
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST), encoding='utf-8') as f:
+            _manifest = json.load(f)
+    except (OSError, ValueError):
+        _manifest = {'assets': {}, 'encodings': {}}
+
+def manifest_digest():
+    """Changes whenever a build changes any asset URL"""
+    return hashlib.sha1(json.dumps(_manifest['assets'], sort_keys=True).encode()).hexdigest()
+
+def _fingerprint_url(endpoint, values):
+    # In debug mode the sources are served, so edits show without a rebuild
+    if endpoint == 'static' and not current_app.debug:
+        hashed = _manifest['assets'].get(values.get('filename'))
+        if hashed:
+            values['filename'] = hashed
+
+def static_view(filename):
+    """The 'static' endpoint: fingerprinted files are immutable and precompressed."""
+    # The manifest changes with every build, so it is not immutable
+    if not filename.startswith(DIST_DIR + '/') or filename == f"{DIST_DIR}/{MANIFEST}":
+        return current_app.send_static_file(filename)
+    encodings = _manifest['encodings'].get(filename, ())
+    for encoding in ENCODINGS:
+        # Indexing gives the client's quality value, 0 for q=0 or not listed
+        if encoding in encodings and request.accept_encodings[encoding] > 0:
+            response = send_from_directory(current_app.static_folder, filename + ENCODINGS[encoding],
+                                           mimetype=mimetypes.guess_type(filename)[0],
+                                           max_age=IMMUTABLE_MAX_AGE)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(current_app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    return response
+
+def init_app(app):
+    load_manifest(app.static_folder)
+    app.url_defaults(_fingerprint_url)
+    app.view_functions['static'] = static_view
@@ -0,0 +1 @@
+"""Benchmarks for the store; run them as modules, e.g. python -m benchmarks.read_path"""
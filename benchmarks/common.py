@@ -0,0 +1,87 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import database
+from init_db import WORDS, generate_database
+
+def use_database(path):
+    """Point database.py (and so the app) at another SQLite file."""
+    database.DATABASE = path
+
+def build_catalog(path, categories=10, products=10000, reviews=20000, seed=1):
+    """Create a synthetic catalog in a fresh database file at path."""
+    generate_database(path, categories=categories, products=products, users=max(100, reviews // 20),
+                      orders=0, reviews=reviews, seed=seed)
+    use_database(path)
+
+def percentile(sorted_samples, fraction):
+    index = min(int(len(sorted_samples) * fraction), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+def run_load(request_fn, targets, concurrency):
+    """
+    Call request_fn(target) for every target from `concurrency` threads.
+    request_fn returns True on success; an exception it raises counts as an
+    error too, and the thread carries on. Returns latency and throughput stats.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    queue = list(targets)
+    queue.reverse()
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                if not queue:
+                    return
+                target = queue.pop()
+            start = time.perf_counter()
+            try:
+                ok = request_fn(target)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'req_per_s': round(len(latencies) / wall, 1) if wall else None,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_report(report, output=None):
+    report.setdefault('git_revision', git_revision())
+    report.setdefault('python', sys.version.split()[0])
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
@@ -0,0 +1,78 @@
+"""
+Login throughput (POST /login) for growing password pool sizes, per core.
+
+    python -m benchmarks.password_hashing --method pbkdf2:sha256:260000 --logins 200
+
+Every synthetic user gets the same password hashed with --method, so no
+login triggers a rehash. For each pool size the report gives logins/s and
+logins/s per core actually used; with a GIL-free hash the per-core figure
+should stay roughly flat until the pool outgrows the machine.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+
+import database
+import passwords
+from benchmarks.common import build_catalog, run_load, use_database, write_report
+
+PASSWORD = 'user123'
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--method', default=passwords.METHOD, help='werkzeug hash method to benchmark')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, max(cpus // 2, 1), cpus}), help='pool sizes to try')
+    parser.add_argument('--logins', type=int, default=100, help='logins per pool size')
+    parser.add_argument('--concurrency', type=int, help='concurrent requests (default: 2x the largest pool)')
+    parser.add_argument('--database', help='reuse this database file instead of building a new one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    if args.database:
+        use_database(args.database)
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix='store-bench-'), 'bench.db')
+        build_catalog(path, categories=2, products=100, reviews=2000, seed=args.seed)
+
+    # Imported late: app.py initialises database.DATABASE on import.
+    from app import app
+
+    passwords.configure(method=args.method)
+    password_hash = passwords.hash_password(PASSWORD)
+    with database.get_db() as db:
+        db.execute('UPDATE users SET password_hash = ?', (password_hash,))
+        db.commit()
+        emails = [row['email'] for row in db.execute('SELECT email FROM users')]
+
+    local = threading.local()
+
+    def login(email):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        response = local.client.post('/login', data={'email': email, 'password': PASSWORD})
+        return response.status_code == 302 and response.location.endswith('/')
+
+    rng = random.Random(args.seed)
+    concurrency = args.concurrency or 2 * max(args.workers)
+    results = {}
+    for workers in args.workers:
+        passwords.configure(workers=workers)
+        run_load(login, rng.choices(emails, k=min(10, args.logins)), concurrency)
+        stats = run_load(login, rng.choices(emails, k=args.logins), concurrency)
+        stats['logins_per_s_per_core'] = round(stats['req_per_s'] / min(workers, cpus), 1)
+        results[str(workers)] = stats
+
+    write_report({
+        'benchmark': 'password_hashing',
+        'config': {**{key: value for key, value in vars(args).items() if key != 'output'},
+                   'concurrency': concurrency, 'cpus': cpus},
+        'pool_sizes': results,
+    }, args.output)
+
+if __name__ == '__main__':
+    main()
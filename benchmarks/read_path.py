@@ -0,0 +1,91 @@
+"""
+Latency/throughput of the storefront read path: /, /<category>,
+/product/<id> and /search, on a synthetic catalog.
+
+    python -m benchmarks.read_path --products 20000 --concurrency 8 --output before.json
+
+Requests go through the Flask test client by default, or through a local
+threaded WSGI server with --server. Results are printed (and optionally
+written) as JSON so runs can be compared between commits.
+"""
+import argparse
+import http.client
+import os
+import random
+import tempfile
+import threading
+from urllib.parse import quote
+
+from benchmarks.common import WORDS, build_catalog, run_load, use_database, write_report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=500, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--server', action='store_true', help='use a local WSGI server instead of the test client')
+    parser.add_argument('--database', help='reuse this database file instead of building a new one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    if args.database:
+        use_database(args.database)
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix='store-bench-'), 'bench.db')
+        build_catalog(path, args.categories, args.products, args.reviews, args.seed)
+
+    # Imported late: app.py initialises database.DATABASE on import.
+    from app import app
+
+    rng = random.Random(args.seed)
+    routes = {
+        '/': lambda: '/',
+        '/<category>': lambda: f"/kategoria-{rng.randint(1, args.categories)}?sort={rng.choice(['newest', 'price_asc', 'name_asc'])}",
+        '/product/<id>': lambda: f"/product/{rng.randint(1, args.products)}",
+        '/search': lambda: f"/search?q={quote(rng.choice(WORDS))}",
+    }
+
+    if args.server:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        local = threading.local()
+
+        def request(url):
+            try:
+                if not hasattr(local, 'conn'):
+                    local.conn = http.client.HTTPConnection('127.0.0.1', server.server_port)
+                local.conn.request('GET', url)
+                response = local.conn.getresponse()
+                response.read()
+                return response.status == 200
+            except (OSError, http.client.HTTPException):
+                del local.conn
+                return False
+    else:
+        local = threading.local()
+
+        def request(url):
+            if not hasattr(local, 'client'):
+                local.client = app.test_client()
+            return local.client.get(url).status_code == 200
+
+    results = {}
+    for name, make_url in routes.items():
+        warmup = [make_url() for _ in range(min(50, args.requests))]
+        run_load(request, warmup, args.concurrency)
+        results[name] = run_load(request, [make_url() for _ in range(args.requests)], args.concurrency)
+
+    if args.server:
+        server.shutdown()
+    write_report({
+        'benchmark': 'read_path',
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'routes': results,
+    }, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Storefront throughput and latency in the WSGI and ASGI serving modes at
+growing client concurrency.
+
+    python -m benchmarks.serving_modes --concurrency 1 8 32 128 --db-workers 4 16
+
+Each mode is served by a separate process on the same synthetic catalog:
+WSGI by Werkzeug's threaded server (what app.run uses, one thread per
+connection), ASGI by uvicorn with asgi.py, once per --db-workers pool size.
+Clients fetch a mix of category, product and search pages over keep-alive
+connections.
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from benchmarks.common import WORDS, build_catalog, run_load, use_database, write_report
+
+def serve(mode, port, database_path):
+    """Run the store in one serving mode (the body of a server process)."""
+    use_database(database_path)
+    if mode == 'wsgi':
+        from werkzeug.serving import run_simple
+        from app import app
+        run_simple('127.0.0.1', port, app, threaded=True)
+    else:
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host='127.0.0.1', port=port, log_level='warning')
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(mode, database_path, db_workers=None):
+    port = _free_port()
+    env = dict(os.environ)
+    if db_workers:
+        env['STORE_DB_WORKERS'] = str(db_workers)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.serving_modes', '--serve', mode,
+         '--port', str(port), '--database', database_path],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=500, help='requests per concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--db-workers', type=int, nargs='+', default=[4, 16],
+                        help='database pool sizes to try in ASGI mode')
+    parser.add_argument('--database', help='reuse this database file instead of building a new one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.database)
+        return
+
+    path = args.database
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='store-bench-'), 'bench.db')
+        build_catalog(path, args.categories, args.products, args.reviews, args.seed)
+
+    rng = random.Random(args.seed)
+
+    def make_url():
+        kind = rng.random()
+        if kind < 0.4:
+            return f"/product/{rng.randint(1, args.products)}"
+        if kind < 0.8:
+            return f"/kategoria-{rng.randint(1, args.categories)}?sort={rng.choice(['newest', 'price_asc', 'name_asc'])}"
+        return f"/search?q={quote(rng.choice(WORDS))}"
+
+    modes = [('wsgi', None)] + [('asgi', workers) for workers in args.db_workers]
+    results = {}
+    for mode, db_workers in modes:
+        process, port = start_server(mode, path, db_workers)
+        local = threading.local()
+
+        def request(url):
+            try:
+                if not hasattr(local, 'conn'):
+                    local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                local.conn.request('GET', url)
+                response = local.conn.getresponse()
+                response.read()
+                return response.status == 200
+            except (OSError, http.client.HTTPException):
+                del local.conn
+                return False
+
+        name = mode if db_workers is None else f"{mode}_db{db_workers}"
+        results[name] = {}
+        try:
+            for concurrency in args.concurrency:
+                run_load(request, [make_url() for _ in range(min(50, args.requests))], concurrency)
+                results[name][str(concurrency)] = run_load(
+                    request, [make_url() for _ in range(args.requests)], concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+
+    write_report({
+        'benchmark': 'serving_modes',
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'serve', 'port')},
+        'cpus': os.cpu_count(),
+        'modes': results,
+    }, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Worker startup cost: time to import app (which checks the schema) in a
+fresh interpreter, against an existing database.
+
+    python -m benchmarks.startup --runs 20 --output before.json
+
+Each run is a new process, as for a worker boot or a reload. The report
+gives the median and best process wall time, import time and the part of
+it spent in database.init_db(), and whether Pillow was loaded. Compare
+reports between commits.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import build_catalog, write_report
+
+# Runs in the child process: times `import app`, and init_db() within it.
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import database
+database.DATABASE = sys.argv[1]
+timings = {}
+init_db = database.init_db
+def timed_init_db():
+    start = time.perf_counter()
+    init_db()
+    timings['init_db_ms'] = (time.perf_counter() - start) * 1000
+database.init_db = timed_init_db
+import app
+timings['import_ms'] = (time.perf_counter() - started) * 1000
+timings['pillow_loaded'] = 'PIL' in sys.modules
+timings['modules'] = len(sys.modules)
+print(json.dumps(timings))
+'''
+
+def boot(path):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD, path], capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process_ms'] = (time.perf_counter() - start) * 1000
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--database', help='reuse this database file instead of building a new one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    path = args.database
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='store-bench-'), 'bench.db')
+        build_catalog(path, products=args.products, reviews=args.reviews, seed=args.seed)
+    path = os.path.abspath(path)
+
+    # The first boot may migrate and pays for cold caches
+    first = boot(path)
+    runs = [boot(path) for _ in range(args.runs)]
+    summary = {}
+    for key in ('process_ms', 'import_ms', 'init_db_ms'):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {'median': round(statistics.median(values), 1), 'min': round(min(values), 1)}
+    summary['pillow_loaded'] = runs[-1]['pillow_loaded']
+    summary['modules'] = runs[-1]['modules']
+
+    write_report({
+        'benchmark': 'startup',
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'first_boot': {key: round(value, 1) if isinstance(value, float) else value for key, value in first.items()},
+        'boot': summary,
+    }, args.output)
+
+if __name__ == '__main__':
+    main()
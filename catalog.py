@@ -0,0 +1,225 @@
+"""
+Optional in-process snapshot of the catalog for browse queries, switched on
+with STORE_CATALOG_SNAPSHOT=1.
+
+The snapshot keeps the columns listings filter and sort on in compact
+arrays (one slot per product) plus every category's products presorted by
+price, name and date. Category listings, facets, brand lists and the
+featured products are then filtered and sorted in memory, and SQLite is
+only asked for the full rows of the page being shown, by primary key.
+
+Stock is left out on purpose: nothing filters on it and it changes with
+every order. The snapshot is rebuilt from one scan of products whenever the
+'catalog:browse' change stamp (or the database epoch) moves, which only
+happens when a product is added or removed or a filtered or sorted column
+changes.
+"""
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import database
+
+ENABLED = os.environ.get('STORE_CATALOG_SNAPSHOT') == '1'
+
+# Snapshot column holding each sort column's key, see database.CATEGORY_SORTS
+SORT_KEYS = {
+    'p.price': 'prices',
+    'p.name COLLATE NOCASE': 'name_keys',
+    'p.date_added': 'dates',
+}
+# SQLite's NOCASE only folds ASCII letters
+_NOCASE = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+_snapshot = None
+_build_lock = threading.Lock()
+_stats = {'builds': 0, 'last_build_ms': None, 'products': 0}
+
+class CatalogSnapshot:
+    """Column arrays of the products table, indexed by row number."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.ids = array('q')
+        self.category_ids = array('q')
+        self.brand_codes = array('l')    # index into self.brands, -1 for none
+        self.prices = array('d')
+        self.dates = array('l')          # index into self.date_values (sorted)
+        self.name_keys = []              # NOCASE-folded names, for the name sort
+        self.brands = []
+        brand_codes = {}
+        raw_dates = []
+        for product_id, category_id, brand, price, date_added, name in rows:
+            self.ids.append(product_id)
+            self.category_ids.append(category_id if category_id is not None else -1)
+            if brand:
+                code = brand_codes.get(brand)
+                if code is None:
+                    code = brand_codes[brand] = len(self.brands)
+                    self.brands.append(brand)
+                self.brand_codes.append(code)
+            else:
+                self.brand_codes.append(-1)
+            self.prices.append(float(price) if price is not None else float('-inf'))
+            raw_dates.append(date_added or '')
+            self.name_keys.append((name or '').translate(_NOCASE))
+        # Dates are stored as their rank, which sorts exactly like the text
+        self.date_values = sorted(set(raw_dates))
+        date_ranks = {value: rank for rank, value in enumerate(self.date_values)}
+        self.dates.extend(date_ranks[value] for value in raw_dates)
+
+        # Per category: row numbers in ascending (key, id) order for every
+        # sort column (descending sorts walk them backwards), the sorted
+        # brand names and the first product's id.
+        self.orders = {}
+        self.category_brands = {}
+        self.first_ids = {}
+        by_category = {}
+        for row in range(len(self.ids)):
+            by_category.setdefault(self.category_ids[row], []).append(row)
+        for category_id, rows_in_category in by_category.items():
+            for column, attribute in SORT_KEYS.items():
+                keys = getattr(self, attribute)
+                ordered = sorted(rows_in_category, key=lambda r: (keys[r], self.ids[r]))
+                self.orders[category_id, column] = array('l', ordered)
+            self.category_brands[category_id] = sorted(
+                {self.brands[self.brand_codes[r]] for r in rows_in_category if self.brand_codes[r] >= 0})
+            self.first_ids[category_id] = min(self.ids[r] for r in rows_in_category)
+
+    def sort_key(self, column, value):
+        """Key of a cursor value for `column`, comparable with the stored keys."""
+        if column == 'p.price':
+            return float(value) if value is not None else float('-inf')
+        value = str(value) if value is not None else ''
+        if column == 'p.date_added':
+            # Between two stored ranks when the date itself is not stored
+            rank = bisect_left(self.date_values, value)
+            exact = rank < len(self.date_values) and self.date_values[rank] == value
+            return rank if exact else rank - 0.5
+        return value.translate(_NOCASE)
+
+    def position_after(self, order, keys, key, product_id):
+        """Index in `order` of the first row sorting after (key, product_id)."""
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            row = order[middle]
+            if (keys[row], self.ids[row]) <= (key, product_id):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+def _current_version():
+    return database.get_change_stamps(['catalog:browse'])['versions']
+
+def get_snapshot():
+    """The current snapshot, rebuilt first if the catalog has changed."""
+    global _snapshot
+    version = _current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _build_lock:
+        # Another thread may have rebuilt it while we waited
+        version = _current_version()
+        if _snapshot is None or _snapshot.version != version:
+            start = time.perf_counter()
+            with database.get_db() as db:
+                rows = db.execute(
+                    'SELECT id, category_id, brand, price, date_added, name FROM products'
+                ).fetchall()
+            _snapshot = CatalogSnapshot(version, rows)
+            _stats['builds'] += 1
+            _stats['last_build_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            _stats['products'] = len(rows)
+        return _snapshot
+
+def get_stats():
+    return dict(_stats)
+
+def get_products_by_category(category_slug, brands=None, price_min=None, price_max=None, sort=None,
+                             limit=None, cursor=None):
+    """In-memory database.get_products_by_category, with the same arguments and result."""
+    category = database.get_category_by_slug(category_slug)
+    if category is None:
+        return []
+    snapshot = get_snapshot()
+    sort = database._category_sort(sort)
+    column, descending = database.CATEGORY_SORTS[sort]
+    order = snapshot.orders.get((category['id'], column), array('l'))
+    keys = getattr(snapshot, SORT_KEYS[column])
+
+    # Continue after the cursor position (ignored if made for another sort or malformed)
+    after = None
+    position = database.decode_cursor(cursor, 3)
+    if position and position[0] == sort and isinstance(position[2], int):
+        try:
+            after = snapshot.sort_key(column, position[1]), position[2]
+        except (TypeError, ValueError):
+            after = None
+
+    # Walk the presorted rows from there (backwards for descending sorts)
+    if descending:
+        start = len(order)
+        if after:
+            # First row at or after the cursor (ids are integers), so walking
+            # back from just before it starts strictly before the cursor
+            start = snapshot.position_after(order, keys, after[0], after[1] - 1)
+        indexes = range(start - 1, -1, -1)
+    else:
+        start = snapshot.position_after(order, keys, *after) if after else 0
+        indexes = range(start, len(order))
+
+    brand_codes = None
+    if brands:
+        brand_codes = {code for code, brand in enumerate(snapshot.brands) if brand in brands}
+    product_ids = []
+    for index in indexes:
+        row = order[index]
+        if brand_codes is not None and snapshot.brand_codes[row] not in brand_codes:
+            continue
+        price = snapshot.prices[row]
+        if (price_min and price < price_min) or (price_max and price > price_max):
+            continue
+        product_ids.append(snapshot.ids[row])
+        if limit is not None and len(product_ids) >= limit:
+            break
+    return database.get_category_products_by_ids(category, product_ids)
+
+def get_category_facets(category_id, brands=None, price_min=None, price_max=None):
+    """In-memory database.get_category_facets."""
+    snapshot = get_snapshot()
+    rows = snapshot.orders.get((category_id, 'p.price'), ())
+    pairs = (
+        (snapshot.brands[snapshot.brand_codes[row]] if snapshot.brand_codes[row] >= 0 else None,
+         snapshot.prices[row])
+        for row in rows
+    )
+    return database.facets_from_rows(pairs, brands, price_min, price_max)
+
+def get_brands_for_category(category_slug):
+    """In-memory database.get_brands_for_category."""
+    category = database.get_category_by_slug(category_slug)
+    if category is None:
+        return []
+    return list(get_snapshot().category_brands.get(category['id'], []))
+
+def get_featured_products():
+    """database.get_featured_products, with the first product per category known in advance."""
+    snapshot = get_snapshot()
+    first_ids = [product_id for category_id, product_id in snapshot.first_ids.items() if category_id >= 0]
+    if not first_ids:
+        return []
+    return database.get_featured_products_by_ids(first_ids)
+
+def init_app(app):
+    """Route database.py's browse queries through the snapshot if STORE_CATALOG_SNAPSHOT=1."""
+    if not ENABLED:
+        return
+    database.get_products_by_category = get_products_by_category
+    database.get_category_facets = get_category_facets
+    database.get_brands_for_category = get_brands_for_category
+    database.get_featured_products = get_featured_products
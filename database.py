@@ -1,185 +1,651 @@
+import base64
+import json
+import logging
+import os
+import re
 import sqlite3
+import threading
 from contextlib import contextmanager
+from pathlib import Path
 
 DATABASE = 'store.db'
 
+logger = logging.getLogger('store.database')
+
+# Connection tuning, applied once when a pooled connection is opened.
+# cache_size is negative, so it is a size in KiB rather than in pages.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('cache_size', -16000),
+    ('busy_timeout', 5000),
+)
+STATEMENT_CACHE_SIZE = 256
+# Replaced by profiling.py with a timing subclass when profiling is enabled.
+connection_factory = sqlite3.Connection
+
+# Connections are kept per thread (sqlite3 connections must not be shared
+# between threads) and per database path, and dropped after a fork.
+_local = threading.local()
+_stats_lock = threading.Lock()
+_pool_stats = {'opened': 0, 'checkouts': 0}
+
+def _open_connection(path):
+    db = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE, factory=connection_factory)
+    db.row_factory = sqlite3.Row
+    for pragma, value in CONNECTION_PRAGMAS:
+        db.execute(f"PRAGMA {pragma} = {value}")
+    return db
+
+def _thread_pool():
+    pool = getattr(_local, 'pool', None)
+    if pool is None or _local.pid != os.getpid():
+        pool = _local.pool = {}
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return pool
+
 @contextmanager
 def get_db():
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
+    """
+    Yield this thread's pooled connection to DATABASE.
+    Nested calls share the connection; when the outermost block exits,
+    anything left uncommitted is rolled back, as closing used to do.
+    """
+    pool = _thread_pool()
+    db = pool.get(DATABASE)
+    with _stats_lock:
+        _pool_stats['checkouts'] += 1
+        if db is None:
+            _pool_stats['opened'] += 1
+    if db is None:
+        db = pool[DATABASE] = _open_connection(DATABASE)
+    _local.depth += 1
     try:
         yield db
     finally:
+        _local.depth -= 1
+        if _local.depth == 0 and db.in_transaction:
+            db.rollback()
+
+def close_db_connections():
+    """Close the pooled connections owned by the calling thread."""
+    pool = _thread_pool()
+    for db in pool.values():
         db.close()
+    pool.clear()
 
-def init_db():
-    with get_db() as db:
-        # Users table
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            full_name TEXT,
-            address TEXT,
-            is_admin BOOLEAN NOT NULL DEFAULT 0
-        )
-        """)
+def get_pool_stats():
+    """Connection reuse counters, summed over all threads."""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    stats['reused'] = stats['checkouts'] - stats['opened']
+    stats['reuse_rate'] = stats['reused'] / stats['checkouts'] if stats['checkouts'] else 0.0
+    return stats
 
-        # Categories table (updated to ensure slug is present as per PRD)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            slug TEXT NOT NULL UNIQUE
-        )
-        """)
-        
-        # Products table (with recommended additions)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            price DECIMAL(10,2) NOT NULL,
-            description TEXT,
-            image TEXT,
-            category_id INTEGER,
-            brand TEXT,
-            stock_quantity INTEGER NOT NULL DEFAULT 0,
-            slug TEXT UNIQUE,
-            date_added TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (category_id) REFERENCES categories (id)
+def _add_column_if_missing(db, table, column, declaration):
+    columns = [row['name'] for row in db.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+# Schema migrations. PRAGMA user_version holds the number of migrations
+# applied; MIGRATIONS[n] takes a database from version n to n + 1, so new
+# schema changes are appended, never edited in place. The migrations up to
+# the sales rollups use IF NOT EXISTS throughout, which lets them adopt
+# databases created before the schema was versioned.
+
+def _migrate_core_tables(db):
+    # Users table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        full_name TEXT,
+        address TEXT,
+        is_admin BOOLEAN NOT NULL DEFAULT 0
+    )
+    """)
+
+    # Categories table (updated to ensure slug is present as per PRD)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        slug TEXT NOT NULL UNIQUE
+    )
+    """)
+    
+    # Products table (with recommended additions)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price DECIMAL(10,2) NOT NULL,
+        description TEXT,
+        image TEXT,
+        category_id INTEGER,
+        brand TEXT,
+        stock_quantity INTEGER NOT NULL DEFAULT 0,
+        slug TEXT UNIQUE,
+        date_added TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (category_id) REFERENCES categories (id)
+    )
+    """)
+    
+    # Orders table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        order_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        total_amount DECIMAL(10,2) NOT NULL,
+        status TEXT NOT NULL,
+        shipping_address TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    
+    # Order Items table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price DECIMAL(10,2) NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    """)
+    
+    # Product Reviews table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS product_reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+        comment TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (product_id) REFERENCES products (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    # Comma-separated names of the image renditions that are ready
+    # (NULL for products whose image predates the renditions).
+    _add_column_if_missing(db, 'products', 'image_renditions', 'TEXT')
+
+def _migrate_indexes(db):
+    # Indexes (as per PRD section 3.6, SQLite auto-creates for PK and UNIQUE)
+    # Explicitly creating indexes for foreign keys as good practice,
+    # though some SQLite versions might do it for F_K_ON.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_category_id ON products (category_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)")
+    # One index per sort mode of a category listing.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category_id, price)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_category_date ON products (category_id, date_added)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_category_name ON products (category_id, name COLLATE NOCASE)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_category_brand_price ON products (category_id, brand, price)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders (user_id, order_date)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (order_date)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders (status COLLATE NOCASE, order_date)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_product_reviews_product_id ON product_reviews (product_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_product_reviews_user_id ON product_reviews (user_id)")
+
+def _migrate_rating_summary(db):
+    # Per-product review aggregates, maintained by add_product_review
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS product_rating_summary (
+        product_id INTEGER PRIMARY KEY,
+        review_count INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        rating_1 INTEGER NOT NULL DEFAULT 0,
+        rating_2 INTEGER NOT NULL DEFAULT 0,
+        rating_3 INTEGER NOT NULL DEFAULT 0,
+        rating_4 INTEGER NOT NULL DEFAULT 0,
+        rating_5 INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_product_reviews_product_date ON product_reviews (product_id, created_at)")
+    rebuild_rating_summaries(db)
+
+def _migrate_carts(db):
+    # Shopping carts, keyed by the random token kept in the session
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS cart_items (
+        cart_token TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (cart_token, product_id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    ) WITHOUT ROWID
+    """)
+
+def _migrate_sales_rollups(db):
+    # Sales rollups, maintained by create_order and update_order_status
+    # (see _apply_order_to_rollups). Category 0 collects products
+    # without a category.
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS sales_by_product (
+        product_id INTEGER PRIMARY KEY,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS sales_by_category (
+        category_id INTEGER PRIMARY KEY,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS order_status_counts (
+        status TEXT PRIMARY KEY COLLATE NOCASE,
+        orders INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sales_by_product_revenue ON sales_by_product (revenue)")
+    rebuild_sales_rollups(db)
+
+# Full-text search over products. unicode61 strips Polish diacritics except
+# for "ł", which is a letter of its own in Unicode, so it is folded by hand
+# both in the indexed text and in the query.
+SEARCH_PAGE_SIZE = 24
+SEARCH_WEIGHTS = (10.0, 5.0, 1.0)  # name, brand, description
+
+def _fold_sql(column):
+    return f"replace(replace({column}, 'ł', 'l'), 'Ł', 'L')"
+
+def _fold(text):
+    return text.replace('ł', 'l').replace('Ł', 'L')
+
+def _init_search_index(db):
+    created = not db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"
+    ).fetchone()
+    db.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, brand, description,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """)
+    if created:
+        weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+        db.execute(
+            "INSERT INTO products_fts (products_fts, rank) VALUES ('rank', ?)",
+            (f"bm25({weights})",)
         )
+
+    folded_new = ', '.join(_fold_sql(f"new.{c}") for c in ('name', 'brand', 'description'))
+    db.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name, brand, description)
+        VALUES (new.id, {folded_new});
+    END
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+    END
+    """)
+    db.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, brand, description ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+        INSERT INTO products_fts (rowid, name, brand, description)
+        VALUES (new.id, {folded_new});
+    END
+    """)
+
+    # Rows written before the triggers existed (or by a bulk load that
+    # skipped them) are picked up here.
+    indexed = db.execute("SELECT count(*) FROM products_fts").fetchone()[0]
+    total = db.execute("SELECT count(*) FROM products").fetchone()[0]
+    if indexed != total:
+        rebuild_search_index(db)
+
+def rebuild_search_index(db):
+    """Re-populate products_fts from the products table."""
+    folded = ', '.join(_fold_sql(c) for c in ('name', 'brand', 'description'))
+    db.execute("DELETE FROM products_fts")
+    db.execute(f"""
+        INSERT INTO products_fts (rowid, name, brand, description)
+        SELECT id, {folded} FROM products
+    """)
+
+def _search_match_expression(search_query):
+    """Turn free text into an FTS5 query: every word, as a prefix, must match."""
+    terms = re.findall(r'\w+', _fold(search_query))
+    return ' '.join(f'"{term}"*' for term in terms)
+
+# Change stamps: a version and last change time (unix seconds) per scope,
+# bumped by triggers so pages can be revalidated without re-querying them.
+# Scopes: 'product:<id>' and 'category:<id>' (their rows and reviews),
+# 'catalog' (any product), 'catalog:browse' (see below) and 'categories'
+# (the category list itself).
+# 'epoch' is a random value per database, so a recreated database never
+# repeats the validators of an old one.
+_STAMP_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+_STAMP_UPSERT = "ON CONFLICT (scope) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at"
+
+def _init_change_stamps(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS change_stamps (
+        scope TEXT PRIMARY KEY NOT NULL,
+        version INTEGER NOT NULL,
+        changed_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    db.execute(f"""
+        INSERT OR IGNORE INTO change_stamps (scope, version, changed_at)
+        VALUES ('epoch', abs(random()), {_STAMP_NOW})
+    """)
+    for event, row in (('INSERT', 'new'), ('DELETE', 'old')):
+        db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS products_stamp_{event.lower()} AFTER {event} ON products BEGIN
+            INSERT INTO change_stamps (scope, version, changed_at) VALUES
+                ('product:' || {row}.id, 1, {_STAMP_NOW}),
+                ('category:' || ifnull({row}.category_id, ''), 1, {_STAMP_NOW}),
+                ('catalog', 1, {_STAMP_NOW})
+            {_STAMP_UPSERT};
+        END
         """)
-        
-        # Orders table
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            order_date TEXT DEFAULT CURRENT_TIMESTAMP,
-            total_amount DECIMAL(10,2) NOT NULL,
-            status TEXT NOT NULL,
-            shipping_address TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
+        db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS product_reviews_stamp_{event.lower()} AFTER {event} ON product_reviews BEGIN
+            INSERT INTO change_stamps (scope, version, changed_at)
+            SELECT 'product:' || id, 1, {_STAMP_NOW} FROM products WHERE id = {row}.product_id
+            UNION ALL
+            SELECT 'category:' || category_id, 1, {_STAMP_NOW} FROM products
+            WHERE id = {row}.product_id AND category_id IS NOT NULL
+            {_STAMP_UPSERT};
+        END
         """)
-        
-        # Order Items table
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS order_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            unit_price DECIMAL(10,2) NOT NULL,
-            FOREIGN KEY (order_id) REFERENCES orders (id),
-            FOREIGN KEY (product_id) REFERENCES products (id)
-        )
+    db.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_stamp_update AFTER UPDATE ON products BEGIN
+        INSERT INTO change_stamps (scope, version, changed_at) VALUES
+            ('product:' || new.id, 1, {_STAMP_NOW}),
+            ('category:' || ifnull(old.category_id, ''), 1, {_STAMP_NOW}),
+            ('category:' || ifnull(new.category_id, ''), 1, {_STAMP_NOW}),
+            ('catalog', 1, {_STAMP_NOW})
+        {_STAMP_UPSERT};
+    END
+    """)
+    # 'catalog:browse' only moves when something a listing filters or sorts
+    # on changes, so stock updates from checkouts leave it alone.
+    for event, columns in (('INSERT', ''), ('DELETE', ''),
+                           ('UPDATE', ' OF category_id, brand, price, date_added, name')):
+        db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS products_browse_stamp_{event.lower()} AFTER {event}{columns} ON products BEGIN
+            INSERT INTO change_stamps (scope, version, changed_at) VALUES ('catalog:browse', 1, {_STAMP_NOW})
+            {_STAMP_UPSERT};
+        END
         """)
-        
-        # Product Reviews table
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS product_reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-            comment TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (product_id) REFERENCES products (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS categories_stamp_{event.lower()} AFTER {event} ON categories BEGIN
+            INSERT INTO change_stamps (scope, version, changed_at) VALUES ('categories', 1, {_STAMP_NOW})
+            {_STAMP_UPSERT};
+        END
         """)
 
-        # Indexes (as per PRD section 3.6, SQLite auto-creates for PK and UNIQUE)
-        # Explicitly creating indexes for foreign keys as good practice,
-        # though some SQLite versions might do it for F_K_ON.
-        db.execute("CREATE INDEX IF NOT EXISTS idx_products_category_id ON products (category_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_product_reviews_product_id ON product_reviews (product_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_product_reviews_user_id ON product_reviews (user_id)")
-
-        # Note: Sample data insertion removed for now. Will be handled later if needed.
-        # # Insert initial categories
-        # categories = [
-        #     ('Fotografia', 'fotografia'),
-        #     ('Filmowanie', 'filmowanie'),
-        #     ('Studio', 'studio'),
-        #     ('Druk i edycja', 'druk'),
-        #     ('Drony', 'drony'),
-        #     ('Fotografia mobilna', 'mobile'),
-        #     ('Fotografia analogowa', 'analogowa')
-        # ]
-        # 
-        # db.executemany(
-        #     'INSERT OR IGNORE INTO categories (name, slug) VALUES (?, ?)',
-        #     categories
-        # )
-        # 
-        # # Insert sample products - THIS WILL FAIL WITHOUT UPDATING TO NEW SCHEMA
-        # # products = [
-        # #     ('Canon EOS R6', 12999.00, 'Profesjonalny aparat bezlusterkowy', 'eos_r6.jpg', 'fotografia'),
-        # #     ('Sony A7 IV', 13499.00, 'Pełnoklatkowy aparat mirrorless', 'sony_a7iv.jpg', 'fotografia'),
-        # # ]
-        # # 
-        # # for product in products:
-        # #     name, price, description, image, category_slug = product
-        # #     # This needs to be updated if products table has new NOT NULL fields or different structure
-        # #     db.execute('''
-        # #         INSERT OR IGNORE INTO products (name, price, description, image, category_id)
-        # #         SELECT ?, ?, ?, ?, categories.id
-        # #         FROM categories
-        # #         WHERE categories.slug = ?
-        # #     ''', (name, price, description, image, category_slug))
-        
-        db.commit()
+def get_change_stamps(scopes):
+    """
+    Versions of the given scopes (plus the database epoch) and the latest
+    time any of them changed. Scopes untouched since the stamps were set up
+    fall back to that moment, the epoch's changed_at.
+    """
+    scopes = ['epoch', *scopes]
+    placeholders = ', '.join('?' * len(scopes))
+    with get_db() as db:
+        rows = db.execute(
+            f"SELECT scope, version, changed_at FROM change_stamps WHERE scope IN ({placeholders})",
+            scopes
+        ).fetchall()
+    versions = {row['scope']: (row['version'], row['changed_at']) for row in rows}
+    return {
+        'versions': tuple(versions.get(scope) for scope in scopes),
+        'last_modified': max(changed_at for _, changed_at in versions.values()),
+    }
+
+# Applied in this order; see the note above _migrate_core_tables.
+MIGRATIONS = (
+    _migrate_core_tables,
+    _migrate_indexes,
+    _migrate_rating_summary,
+    _migrate_carts,
+    _init_search_index,
+    _init_change_stamps,
+    _migrate_sales_rollups,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db, target=SCHEMA_VERSION):
+    """
+    Apply the pending migrations up to `target`, each in its own write
+    transaction together with the version bump, so an interrupted upgrade
+    resumes where it stopped and concurrent workers never apply one twice.
+    """
+    while True:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_schema_version(db)
+            if version >= target:
+                db.rollback()
+                return version
+            path = db.execute('PRAGMA database_list').fetchone()[2]
+            logger.info("Migrating %s to schema version %d", path, version + 1)
+            MIGRATIONS[version](db)
+            db.execute(f'PRAGMA user_version = {version + 1}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
 
-def get_products_by_category(category_slug, brands=None, price_min=None, price_max=None, sort=None):
+def init_db():
+    """
+    Make sure the schema is current. On an up-to-date database (every boot
+    but the first after a deploy that adds a migration) this is one PRAGMA
+    read and no write transaction.
+    """
+    with get_db() as db:
+        if get_schema_version(db) < SCHEMA_VERSION:
+            migrate(db)
+    invalidate_category_cache()
+
+# Sort mode -> (sort column, descending). Every mode breaks ties on id so
+# that a (value, id) pair pins down a position for cursor pagination.
+CATEGORY_SORTS = {
+    'price_asc': ('p.price', False),
+    'price_desc': ('p.price', True),
+    'name_asc': ('p.name COLLATE NOCASE', False),
+    'name_desc': ('p.name COLLATE NOCASE', True),
+    'newest': ('p.date_added', True),
+}
+CATEGORY_SORT_VALUES = {
+    'p.price': 'price',
+    'p.name COLLATE NOCASE': 'name',
+    'p.date_added': 'date_added',
+}
+CATEGORY_PAGE_SIZE = 24
+
+def _category_sort(sort):
+    return sort if sort in CATEGORY_SORTS else 'newest'
+
+def make_category_cursor(product, sort=None):
+    """Cursor that continues a category listing right after `product`."""
+    sort = _category_sort(sort)
+    column, _ = CATEGORY_SORTS[sort]
+    return encode_cursor([sort, product[CATEGORY_SORT_VALUES[column]], product['id']])
+
+def get_products_by_category(category_slug, brands=None, price_min=None, price_max=None, sort=None,
+                             limit=None, cursor=None):
     """
     Get products by category, with optional filtering (brands, price range) and sorting.
     brands: list of brand names (or None)
     price_min: minimum price (or None)
     price_max: maximum price (or None)
     sort: 'price_asc', 'price_desc', 'name_asc', 'name_desc', 'newest' (default: newest)
+    limit: maximum number of products to return (or None for all)
+    cursor: from make_category_cursor, to continue after that product (keyset
+            pagination, so deep pages cost the same as the first one)
     """
+    category = get_category_by_slug(category_slug)
+    if category is None:
+        return []
+    sort = _category_sort(sort)
+    column, descending = CATEGORY_SORTS[sort]
     query = '''
-        SELECT products.*, categories.name as category_name, categories.slug as category_slug
-        FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE categories.slug = ?
+        SELECT p.*, ? as category_name, ? as category_slug,
+               coalesce(rs.review_count, 0) as review_count,
+               round(1.0 * rs.rating_sum / rs.review_count, 1) as avg_rating
+        FROM products p
+        LEFT JOIN product_rating_summary rs ON rs.product_id = p.id
+        WHERE p.category_id = ?
     '''
-    params = [category_slug]
+    params = [category['name'], category['slug'], category['id']]
     
     # Filter by brands
     if brands:
-        query += f" AND products.brand IN ({','.join(['?']*len(brands))})"
+        query += f" AND p.brand IN ({','.join(['?']*len(brands))})"
         params.extend(brands)
     # Filter by price
     if price_min:
-        query += " AND products.price >= ?"
+        query += " AND p.price >= ?"
         params.append(price_min)
     if price_max:
-        query += " AND products.price <= ?"
+        query += " AND p.price <= ?"
         params.append(price_max)
+    # Continue after the cursor position (ignored if it was made for another sort).
+    # Spelled out rather than as a row value so that SQLite turns it into a
+    # range on the (category_id, column) index for every sort column.
+    position = decode_cursor(cursor, 3)
+    if position and position[0] == sort:
+        op = '<' if descending else '>'
+        query += f" AND {column} {op}= ? AND ({column} {op} ? OR p.id {op} ?)"
+        _, value, last_id = position
+        params.extend([value, value, last_id])
     # Sorting
-    if sort == 'price_asc':
-        query += " ORDER BY products.price ASC"
-    elif sort == 'price_desc':
-        query += " ORDER BY products.price DESC"
-    elif sort == 'name_asc':
-        query += " ORDER BY products.name COLLATE NOCASE ASC"
-    elif sort == 'name_desc':
-        query += " ORDER BY products.name COLLATE NOCASE DESC"
-    else:  # newest
-        query += " ORDER BY products.date_added DESC"
+    direction = 'DESC' if descending else 'ASC'
+    query += f" ORDER BY {column} {direction}, p.id {direction}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
     with get_db() as db:
         products = db.execute(query, params).fetchall()
         return [dict(product) for product in products]
 
 
+PRICE_HISTOGRAM_BUCKETS = 5
+
+def _price_histogram(prices, low, high):
+    if not prices:
+        return []
+    width = (high - low) / PRICE_HISTOGRAM_BUCKETS or 1
+    counts = [0] * PRICE_HISTOGRAM_BUCKETS
+    for price in prices:
+        counts[min(int((price - low) / width), PRICE_HISTOGRAM_BUCKETS - 1)] += 1
+    return [
+        {'low': low + i * width, 'high': low + (i + 1) * width, 'count': count}
+        for i, count in enumerate(counts)
+    ]
+
+def get_category_facets(category_id, brands=None, price_min=None, price_max=None):
+    """
+    Filter facets of a category from one pass over its (brand, price) pairs,
+    read from a covering index. Brand counts respect the price filter and
+    price facets respect the brand filter, so each facet shows what picking
+    another value would give.
+    """
+    with get_db() as db:
+        rows = db.execute(
+            'SELECT brand, price FROM products WHERE category_id = ?', (category_id,)
+        ).fetchall()
+    return facets_from_rows(rows, brands, price_min, price_max)
+
+def facets_from_rows(rows, brands=None, price_min=None, price_max=None):
+    """Facets (see get_category_facets) of an iterable of (brand, price) pairs."""
+    selected_brands = set(brands or ())
+    brand_counts = {brand: 0 for brand in selected_brands}
+    prices = []
+    for brand, price in rows:
+        if (not price_min or price >= price_min) and (not price_max or price <= price_max) and brand:
+            brand_counts[brand] = brand_counts.get(brand, 0) + 1
+        if not selected_brands or brand in selected_brands:
+            prices.append(price)
+    low = min(prices) if prices else None
+    high = max(prices) if prices else None
+    return {
+        'brands': [{'name': name, 'count': brand_counts[name]} for name in sorted(brand_counts)],
+        'price_min': low,
+        'price_max': high,
+        'price_histogram': _price_histogram(prices, low, high),
+    }
+
+def get_category_listing(category_slug, brands=None, price_min=None, price_max=None, sort=None,
+                         cursor=None, per_page=CATEGORY_PAGE_SIZE):
+    """
+    One page of a category's products plus its filter facets (see
+    get_products_by_category and get_category_facets for the arguments).
+    Returns None for an unknown category, otherwise
+    {'products': [...], 'next_cursor': str or None, 'facets': {'brands':
+    [{'name', 'count'}], 'price_min', 'price_max', 'price_histogram':
+    [{'low', 'high', 'count'}]}}.
+    """
+    category = get_category_by_slug(category_slug)
+    if category is None:
+        return None
+    products = get_products_by_category(category_slug, brands, price_min, price_max, sort,
+                                        limit=per_page + 1, cursor=cursor)
+    next_cursor = None
+    if len(products) > per_page:
+        products = products[:per_page]
+        next_cursor = make_category_cursor(products[-1], sort)
+    return {
+        'products': products,
+        'next_cursor': next_cursor,
+        'facets': get_category_facets(category['id'], brands, price_min, price_max),
+    }
+def get_category_products_by_ids(category, product_ids):
+    """
+    Rows shaped like get_products_by_category's for the given products of
+    a category, in the order of product_ids (used by the catalog snapshot).
+    """
+    products = {}
+    with get_db() as db:
+        # Chunked to stay under SQLite's bound parameter limit
+        for start in range(0, len(product_ids), 500):
+            chunk = product_ids[start:start + 500]
+            rows = db.execute(f'''
+                SELECT p.*, ? as category_name, ? as category_slug,
+                       coalesce(rs.review_count, 0) as review_count,
+                       round(1.0 * rs.rating_sum / rs.review_count, 1) as avg_rating
+                FROM products p
+                LEFT JOIN product_rating_summary rs ON rs.product_id = p.id
+                WHERE p.id IN ({','.join('?' * len(chunk))})
+            ''', [category['name'], category['slug'], *chunk]).fetchall()
+            products.update((row['id'], dict(row)) for row in rows)
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
 def get_brands_for_category(category_slug):
     """Get all unique brands for a given category_slug."""
     with get_db() as db:
@@ -204,6 +670,157 @@ def get_orders_for_user(user_id):
         ''', (user_id,)).fetchall()
         return [dict(row) for row in rows]
 
+ORDER_HISTORY_PAGE_SIZE = 20
+
+def get_orders_with_items_for_user(user_id, page=1, per_page=ORDER_HISTORY_PAGE_SIZE):
+    """
+    One page of a user's orders, newest first, each with its 'items' list.
+    Two queries per page no matter how many orders the user has, plus a
+    count on later pages so a page past the last one shows the last one.
+    Returns (orders, the page shown, has_next).
+    """
+    page = max(page, 1)
+    with get_db() as db:
+        if page > 1:
+            total = db.execute('SELECT count(*) FROM orders WHERE user_id = ?', (user_id,)).fetchone()[0]
+            page = min(page, max(-(-total // per_page), 1))
+        offset = (page - 1) * per_page
+        rows = db.execute('''
+            SELECT * FROM orders WHERE user_id = ?
+            ORDER BY order_date DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', (user_id, per_page + 1, offset)).fetchall()
+        orders = [dict(row) for row in rows[:per_page]]
+        items_by_order = {order['id']: [] for order in orders}
+        if items_by_order:
+            placeholders = ','.join('?' * len(items_by_order))
+            items = db.execute(f'''
+                SELECT oi.*, p.name, p.image FROM order_items oi
+                JOIN products p ON oi.product_id = p.id
+                WHERE oi.order_id IN ({placeholders})
+                ORDER BY oi.order_id, oi.id
+            ''', list(items_by_order)).fetchall()
+            for item in items:
+                items_by_order[item['order_id']].append(dict(item))
+        for order in orders:
+            order['items'] = items_by_order[order['id']]
+        return orders, page, len(rows) > per_page
+
+def encode_cursor(values):
+    """Opaque, URL-safe token for a keyset pagination position."""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, length):
+    """
+    Inverse of encode_cursor; None for a missing or malformed token.
+    Cursors arrive from the URL, so anything that is not a list of plain
+    values ending in a row id is malformed, not a bind parameter for SQLite.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    if not isinstance(values[-1], int) or isinstance(values[-1], bool):
+        return None
+    return values
+
+ADMIN_ORDERS_PAGE_SIZE = 50
+
+def get_orders_page(cursor=None, status=None, date_from=None, date_to=None,
+                    user_email=None, per_page=ADMIN_ORDERS_PAGE_SIZE):
+    """
+    One page of all orders (with user email) for the admin panel, newest first.
+    Keyset-paginated on (order_date, id) so every page costs the same.
+    date_from/date_to: 'YYYY-MM-DD', both inclusive.
+    Returns (orders, next_cursor); next_cursor is None on the last page.
+    """
+    query = '''
+        SELECT o.*, u.email as user_email FROM orders o
+        LEFT JOIN users u ON o.user_id = u.id
+        WHERE 1 = 1
+    '''
+    params = []
+    if status:
+        query += " AND o.status = ? COLLATE NOCASE"
+        params.append(status)
+    if date_from:
+        query += " AND o.order_date >= ?"
+        params.append(date_from)
+    if date_to:
+        query += " AND o.order_date < date(?, '+1 day')"
+        params.append(date_to)
+    if user_email:
+        query += " AND o.user_id = (SELECT id FROM users WHERE email = ?)"
+        params.append(user_email)
+    position = decode_cursor(cursor, 2)
+    if position:
+        query += " AND (o.order_date, o.id) < (?, ?)"
+        params.extend(position)
+    query += " ORDER BY o.order_date DESC, o.id DESC LIMIT ?"
+    params.append(per_page + 1)
+    with get_db() as db:
+        rows = db.execute(query, params).fetchall()
+    orders = [dict(row) for row in rows[:per_page]]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = orders[-1]
+        next_cursor = encode_cursor([last['order_date'], last['id']])
+    return orders, next_cursor
+
+ORDER_EXPORT_COLUMNS = (
+    'order_id', 'order_date', 'status', 'user_email', 'total_amount', 'shipping_address',
+    'item_id', 'product_id', 'product_name', 'quantity', 'unit_price',
+)
+
+def iter_order_export(status=None, date_from=None, date_to=None, batch_size=1000):
+    """
+    Yield lists of up to batch_size export rows (tuples in ORDER_EXPORT_COLUMNS
+    order), one row per order item, oldest order first. Orders without items
+    get one row with empty item columns. Filters work as in get_orders_page.
+
+    Reads through its own read-only connection, not the pooled one, so the
+    long-running statement can be consumed lazily (e.g. by a streaming
+    response) while the thread keeps using get_db() for other queries.
+    Memory use does not depend on the number of rows.
+    """
+    query = '''
+        SELECT o.id, o.order_date, o.status, u.email, o.total_amount, o.shipping_address,
+               oi.id, oi.product_id, p.name, oi.quantity, oi.unit_price
+        FROM orders o
+        LEFT JOIN users u ON u.id = o.user_id
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN products p ON p.id = oi.product_id
+        WHERE 1 = 1
+    '''
+    params = []
+    if status:
+        query += " AND o.status = ? COLLATE NOCASE"
+        params.append(status)
+    if date_from:
+        query += " AND o.order_date >= ?"
+        params.append(date_from)
+    if date_to:
+        query += " AND o.order_date < date(?, '+1 day')"
+        params.append(date_to)
+    query += " ORDER BY o.order_date, o.id, oi.id"
+    db = sqlite3.connect(Path(DATABASE).absolute().as_uri() + '?mode=ro', uri=True)
+    try:
+        cursor = db.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        db.close()
+
 def get_all_orders_with_users():
     """Fetch all orders with user email for admin panel."""
     with get_db() as db:
@@ -224,9 +841,24 @@ def get_order_by_id(order_id):
         return dict(row) if row else None
 
 def update_order_status(order_id, new_status):
+    """Change an order's status and move it between the status counts (and out of or back into sales)"""
     with get_db() as db:
-        db.execute('UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
-        db.commit()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT status FROM orders WHERE id = ?', (order_id,)).fetchone()
+            if row is None:
+                db.rollback()
+                return
+            old_status = row['status']
+            db.execute('UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
+            _count_status(db, old_status, -1)
+            _count_status(db, new_status, 1)
+            if _counts_as_sale(old_status) != _counts_as_sale(new_status):
+                _apply_order_to_rollups(db, order_id, 1 if _counts_as_sale(new_status) else -1)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
 
 def get_order_items(order_id):
     with get_db() as db:
@@ -238,35 +870,235 @@ def get_order_items(order_id):
         return [dict(row) for row in rows]
 
 
-def create_order(user_id, full_name, address, cart, total):
-    """
-    Creates an order and order_items, updates stock. Returns order_id.
-    cart: dict of product_name -> {name, price, image, category, quantity}
-    """
+CART_MAX_AGE_DAYS = 30
+
+def purge_stale_carts(db, max_age_days=CART_MAX_AGE_DAYS):
+    """Delete carts nobody has touched for max_age_days."""
+    db.execute('''
+        DELETE FROM cart_items WHERE cart_token IN (
+            SELECT cart_token FROM cart_items
+            GROUP BY cart_token
+            HAVING MAX(updated_at) < datetime('now', ?)
+        )
+    ''', (f'-{max_age_days} days',))
+
+def add_to_cart(cart_token, product_id, quantity=1):
+    """Add quantity of a product to a cart. Returns False if there is no such product."""
     with get_db() as db:
-        # Insert order
         cursor = db.execute('''
-            INSERT INTO orders (user_id, total_amount, status, shipping_address)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, total, 'nowe', f"{full_name}\n{address}"))
-        order_id = cursor.lastrowid
-        # For each cart item, insert into order_items and update stock
-        for item in cart.values():
-            # Get product_id
-            product = db.execute('SELECT id, stock_quantity FROM products WHERE name = ?', (item['name'],)).fetchone()
-            if not product:
-                raise Exception(f"Produkt nie istnieje: {item['name']}")
-            if product['stock_quantity'] < item['quantity']:
-                raise Exception(f"Brak wystarczającej ilości produktu: {item['name']}")
+            INSERT INTO cart_items (cart_token, product_id, quantity)
+            SELECT ?, id, ? FROM products WHERE id = ?
+            ON CONFLICT (cart_token, product_id) DO UPDATE
+            SET quantity = quantity + excluded.quantity, updated_at = CURRENT_TIMESTAMP
+        ''', (cart_token, quantity, product_id))
+        db.commit()
+        return cursor.rowcount > 0
+
+def set_cart_quantity(cart_token, product_id, quantity):
+    """Set the quantity of a cart line; zero or less removes it."""
+    with get_db() as db:
+        if quantity > 0:
             db.execute('''
+                UPDATE cart_items SET quantity = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE cart_token = ? AND product_id = ?
+            ''', (quantity, cart_token, product_id))
+        else:
+            db.execute('DELETE FROM cart_items WHERE cart_token = ? AND product_id = ?',
+                       (cart_token, product_id))
+        db.commit()
+
+def remove_from_cart(cart_token, product_id):
+    set_cart_quantity(cart_token, product_id, 0)
+
+def get_cart(cart_token):
+    """Cart lines with current product data and prices, in the order they were added"""
+    with get_db() as db:
+        items = db.execute('''
+            SELECT ci.product_id, ci.quantity, p.name, p.price, p.image, p.image_renditions,
+                   p.slug, p.stock_quantity, c.slug as category
+            FROM cart_items ci
+            JOIN products p ON p.id = ci.product_id
+            LEFT JOIN categories c ON c.id = p.category_id
+            WHERE ci.cart_token = ?
+            ORDER BY ci.added_at, ci.product_id
+        ''', (cart_token,)).fetchall()
+        return [dict(item) for item in items]
+
+def get_cart_summary(cart_token):
+    """Number of lines, units and total of a cart, for the layout badge"""
+    with get_db() as db:
+        row = db.execute('''
+            SELECT COUNT(*) AS lines, COALESCE(SUM(ci.quantity), 0) AS units,
+                   COALESCE(SUM(ci.quantity * p.price), 0) AS total
+            FROM cart_items ci
+            JOIN products p ON p.id = ci.product_id
+            WHERE ci.cart_token = ?
+        ''', (cart_token,)).fetchone()
+        return dict(row)
+
+def create_order(user_id, full_name, address, cart_token):
+    """
+    Creates an order from a cart, updates stock and empties the cart.
+    Returns order_id. Prices and the total come from the products table.
+    The write lock is taken before anything is read and stock is only
+    decremented while enough is left, so concurrent checkouts cannot oversell.
+    On any error the whole order is rolled back.
+    """
+    with get_db() as db:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            items = db.execute('''
+                SELECT ci.product_id, ci.quantity, p.name, p.price
+                FROM cart_items ci
+                JOIN products p ON p.id = ci.product_id
+                WHERE ci.cart_token = ?
+            ''', (cart_token,)).fetchall()
+            if not items:
+                raise Exception("Koszyk jest pusty.")
+            total = round(sum(item['price'] * item['quantity'] for item in items), 2)
+
+            cursor = db.execute('''
+                INSERT INTO orders (user_id, total_amount, status, shipping_address)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, total, 'nowe', f"{full_name}\n{address}"))
+            order_id = cursor.lastrowid
+
+            for item in items:
+                updated = db.execute('''
+                    UPDATE products SET stock_quantity = stock_quantity - ?
+                    WHERE id = ? AND stock_quantity >= ?
+                ''', (item['quantity'], item['product_id'], item['quantity'])).rowcount
+                if not updated:
+                    raise Exception(f"Brak wystarczającej ilości produktu: {item['name']}")
+            db.executemany('''
                 INSERT INTO order_items (order_id, product_id, quantity, unit_price)
                 VALUES (?, ?, ?, ?)
-            ''', (order_id, product['id'], item['quantity'], item['price']))
-            # Update stock
-            db.execute('UPDATE products SET stock_quantity = stock_quantity - ? WHERE id = ?', (item['quantity'], product['id']))
-        db.commit()
+            ''', [(order_id, item['product_id'], item['quantity'], item['price']) for item in items])
+            db.execute('DELETE FROM cart_items WHERE cart_token = ?', (cart_token,))
+            _count_status(db, 'nowe', 1)
+            _apply_order_to_rollups(db, order_id, 1)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
         return order_id
 
+# Sales rollups. Cancelled orders are counted by status but left out of
+# the sales figures; each rollup row is keyed by what the dashboard groups
+# on, so reading it never touches orders or order_items.
+CANCELLED_STATUS = 'anulowane'
+ANALYTICS_DAYS = 30
+ANALYTICS_TOP_LIMIT = 20
+
+def _counts_as_sale(status):
+    return (status or '').lower() != CANCELLED_STATUS
+
+def _count_status(db, status, delta):
+    db.execute('''
+        INSERT INTO order_status_counts (status, orders) VALUES (?, ?)
+        ON CONFLICT (status) DO UPDATE SET orders = orders + excluded.orders
+    ''', (status, delta))
+
+def _apply_order_to_rollups(db, order_id, sign):
+    """Add (sign=1) or take back (sign=-1) one order's sales in the rollup tables."""
+    db.execute('''
+        INSERT INTO sales_daily (day, orders, units, revenue)
+        SELECT date(o.order_date), ?1,
+               ?1 * (SELECT coalesce(sum(quantity), 0) FROM order_items WHERE order_id = o.id),
+               ?1 * o.total_amount
+        FROM orders o WHERE o.id = ?2
+        ON CONFLICT (day) DO UPDATE SET
+            orders = orders + excluded.orders,
+            units = units + excluded.units,
+            revenue = round(revenue + excluded.revenue, 2)
+    ''', (sign, order_id))
+    db.execute('''
+        INSERT INTO sales_by_product (product_id, units, revenue)
+        SELECT product_id, ?1 * sum(quantity), ?1 * sum(quantity * unit_price)
+        FROM order_items WHERE order_id = ?2
+        GROUP BY product_id
+        ON CONFLICT (product_id) DO UPDATE SET
+            units = units + excluded.units,
+            revenue = round(revenue + excluded.revenue, 2)
+    ''', (sign, order_id))
+    db.execute('''
+        INSERT INTO sales_by_category (category_id, units, revenue)
+        SELECT ifnull(p.category_id, 0), ?1 * sum(oi.quantity), ?1 * sum(oi.quantity * oi.unit_price)
+        FROM order_items oi JOIN products p ON p.id = oi.product_id
+        WHERE oi.order_id = ?2
+        GROUP BY ifnull(p.category_id, 0)
+        ON CONFLICT (category_id) DO UPDATE SET
+            units = units + excluded.units,
+            revenue = round(revenue + excluded.revenue, 2)
+    ''', (sign, order_id))
+
+def rebuild_sales_rollups(db):
+    """Recompute the sales rollups and status counts from orders and order_items."""
+    for table in ('sales_daily', 'sales_by_product', 'sales_by_category', 'order_status_counts'):
+        db.execute(f"DELETE FROM {table}")
+    sale = "lower(o.status) != ?"
+    db.execute(f'''
+        INSERT INTO sales_daily (day, orders, units, revenue)
+        SELECT date(o.order_date), count(*),
+               sum((SELECT coalesce(sum(quantity), 0) FROM order_items WHERE order_id = o.id)),
+               round(sum(o.total_amount), 2)
+        FROM orders o WHERE {sale}
+        GROUP BY date(o.order_date)
+    ''', (CANCELLED_STATUS,))
+    db.execute(f'''
+        INSERT INTO sales_by_product (product_id, units, revenue)
+        SELECT oi.product_id, sum(oi.quantity), round(sum(oi.quantity * oi.unit_price), 2)
+        FROM order_items oi JOIN orders o ON o.id = oi.order_id
+        WHERE {sale}
+        GROUP BY oi.product_id
+    ''', (CANCELLED_STATUS,))
+    db.execute('''
+        INSERT INTO sales_by_category (category_id, units, revenue)
+        SELECT ifnull(p.category_id, 0), sum(s.units), round(sum(s.revenue), 2)
+        FROM sales_by_product s JOIN products p ON p.id = s.product_id
+        WHERE true
+        GROUP BY ifnull(p.category_id, 0)
+    ''')
+    db.execute('''
+        INSERT INTO order_status_counts (status, orders)
+        SELECT status, count(*) FROM orders GROUP BY status COLLATE NOCASE
+    ''')
+
+def get_sales_analytics(days=ANALYTICS_DAYS, top_limit=ANALYTICS_TOP_LIMIT):
+    """Dashboard figures, read from the rollup tables only"""
+    with get_db() as db:
+        daily = db.execute('''
+            SELECT day, orders, units, revenue FROM sales_daily
+            WHERE day > date('now', ?) ORDER BY day DESC
+        ''', (f'-{days} days',)).fetchall()
+        totals = db.execute('''
+            SELECT coalesce(sum(orders), 0) AS orders, coalesce(sum(units), 0) AS units,
+                   round(coalesce(sum(revenue), 0), 2) AS revenue
+            FROM sales_daily
+        ''').fetchone()
+        products = db.execute('''
+            SELECT s.product_id, s.units, s.revenue, p.name, p.slug
+            FROM sales_by_product s LEFT JOIN products p ON p.id = s.product_id
+            WHERE s.units > 0
+            ORDER BY s.revenue DESC LIMIT ?
+        ''', (top_limit,)).fetchall()
+        categories = db.execute('''
+            SELECT s.category_id, s.units, s.revenue, c.name
+            FROM sales_by_category s LEFT JOIN categories c ON c.id = s.category_id
+            WHERE s.units > 0
+            ORDER BY s.revenue DESC
+        ''').fetchall()
+        statuses = db.execute(
+            'SELECT status, orders FROM order_status_counts WHERE orders > 0 ORDER BY orders DESC'
+        ).fetchall()
+    return {
+        'daily': [dict(row) for row in daily],
+        'totals': dict(totals),
+        'products': [dict(row) for row in products],
+        'categories': [dict(row) for row in categories],
+        'statuses': [dict(row) for row in statuses],
+    }
+
 def get_product_by_name(product_name):
     with get_db() as db:
         product = db.execute('''
@@ -277,10 +1109,40 @@ def get_product_by_name(product_name):
         ''', (product_name,)).fetchone()
         return dict(product) if product else None
 
+# Categories are read on every page render for the navigation but only
+# change through init_db, so they are cached in-process until invalidated.
+_category_cache = None
+_category_cache_lock = threading.Lock()
+_category_cache_stats = {'hits': 0, 'misses': 0}
+
 def get_categories():
-    with get_db() as db:
-        categories = db.execute('SELECT * FROM categories').fetchall()
-        return [dict(category) for category in categories]
+    global _category_cache
+    with _category_cache_lock:
+        categories = _category_cache
+        _category_cache_stats['hits' if categories is not None else 'misses'] += 1
+    if categories is None:
+        with get_db() as db:
+            rows = db.execute('SELECT * FROM categories').fetchall()
+        categories = [dict(row) for row in rows]
+        with _category_cache_lock:
+            _category_cache = categories
+    return [dict(category) for category in categories]
+
+def get_category_by_slug(slug):
+    for category in get_categories():
+        if category['slug'] == slug:
+            return category
+    return None
+
+def invalidate_category_cache():
+    """Drop cached categories; call after writing to the categories table."""
+    global _category_cache
+    with _category_cache_lock:
+        _category_cache = None
+
+def get_category_cache_stats():
+    with _category_cache_lock:
+        return dict(_category_cache_stats)
 
 def get_featured_products():
     with get_db() as db:
@@ -297,15 +1159,97 @@ def get_featured_products():
         ''').fetchall()
         return [dict(product) for product in products]
 
+def get_featured_products_by_ids(product_ids):
+    """get_featured_products when the first product of each category is already known"""
+    with get_db() as db:
+        products = db.execute(f'''
+            SELECT p.*, c.slug as category, c.name as category_name
+            FROM products p
+            JOIN categories c ON p.category_id = c.id
+            WHERE p.id IN ({','.join('?' * len(product_ids))})
+            ORDER BY c.name
+        ''', list(product_ids)).fetchall()
+        return [dict(product) for product in products]
+
+def get_top_products(limit):
+    """Best-selling products by units ordered (id and slug only)"""
+    with get_db() as db:
+        products = db.execute('''
+            SELECT p.id, p.slug
+            FROM (
+                SELECT product_id, SUM(quantity) AS units
+                FROM order_items
+                GROUP BY product_id
+                ORDER BY units DESC
+                LIMIT ?
+            ) top
+            JOIN products p ON p.id = top.product_id
+            ORDER BY top.units DESC
+        ''', (limit,)).fetchall()
+        return [dict(product) for product in products]
+
 def add_product(name, price, description, image_filename, category_slug):
+    """Insert a product and return its id (None if the category does not exist)."""
     with get_db() as db:
-        db.execute('''
+        cursor = db.execute('''
             INSERT INTO products (name, price, description, image, category_id)
             SELECT ?, ?, ?, ?, categories.id
             FROM categories
             WHERE categories.slug = ?
         ''', (name, price, description, image_filename, category_slug))
         db.commit()
+        return cursor.lastrowid if cursor.rowcount else None
+
+def get_products_by_slugs(slugs):
+    """{slug: {'id', 'image'}} for those of the slugs that exist"""
+    with get_db() as db:
+        rows = db.execute(
+            f"SELECT id, slug, image FROM products WHERE slug IN ({','.join('?' * len(slugs))})",
+            list(slugs)
+        ).fetchall()
+        return {row['slug']: {'id': row['id'], 'image': row['image']} for row in rows}
+
+def upsert_products(products):
+    """
+    Insert or update products by slug, all in one transaction.
+    products: dicts with slug, name, price, description, category_id, brand,
+    stock_quantity and image (None keeps the current image).
+    Returns {slug: product id}.
+    """
+    with get_db() as db:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany('''
+                INSERT INTO products (slug, name, price, description, category_id, brand, stock_quantity, image)
+                VALUES (:slug, :name, :price, :description, :category_id, :brand, :stock_quantity, :image)
+                ON CONFLICT (slug) DO UPDATE SET
+                    name = excluded.name,
+                    price = excluded.price,
+                    description = excluded.description,
+                    category_id = excluded.category_id,
+                    brand = excluded.brand,
+                    stock_quantity = excluded.stock_quantity,
+                    image = coalesce(excluded.image, products.image),
+                    image_renditions = CASE WHEN excluded.image IS NULL THEN products.image_renditions END
+            ''', products)
+            slugs = [product['slug'] for product in products]
+            rows = db.execute(
+                f"SELECT id, slug FROM products WHERE slug IN ({','.join('?' * len(slugs))})", slugs
+            ).fetchall()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return {row['slug']: row['id'] for row in rows}
+
+def set_product_image(product_id, image_filename, renditions):
+    """Point a product at its processed image and record the ready renditions."""
+    with get_db() as db:
+        db.execute(
+            'UPDATE products SET image = ?, image_renditions = ? WHERE id = ?',
+            (image_filename, ','.join(renditions), product_id)
+        )
+        db.commit()
 
 def get_all_products():
     with get_db() as db:
@@ -340,44 +1284,105 @@ def get_product_by_id_or_slug(identifier):
         
         return dict(product) if product else None
 
-def get_product_reviews(product_id):
-    """Get all reviews for a product"""
+REVIEWS_PAGE_SIZE = 10
+
+def get_product_reviews(product_id, page=1, per_page=REVIEWS_PAGE_SIZE):
+    """Get one page of reviews for a product, newest first"""
+    offset = (max(page, 1) - 1) * per_page
     with get_db() as db:
         reviews = db.execute('''
             SELECT pr.*, u.full_name as user_name, u.email as user_email
             FROM product_reviews pr
             JOIN users u ON pr.user_id = u.id
             WHERE pr.product_id = ?
-            ORDER BY pr.created_at DESC
-        ''', (product_id,)).fetchall()
+            ORDER BY pr.created_at DESC, pr.id DESC
+            LIMIT ? OFFSET ?
+        ''', (product_id, per_page, offset)).fetchall()
         return [dict(review) for review in reviews]
 
+def get_rating_summary(product_id):
+    """Review count, average rating and a 1-5 histogram ({rating: count}) for a product"""
+    with get_db() as db:
+        row = db.execute(
+            'SELECT * FROM product_rating_summary WHERE product_id = ?', (product_id,)
+        ).fetchone()
+    if not row or not row['review_count']:
+        return {'count': 0, 'average': 0, 'histogram': {rating: 0 for rating in range(1, 6)}}
+    return {
+        'count': row['review_count'],
+        'average': round(row['rating_sum'] / row['review_count'], 1),
+        'histogram': {rating: row[f'rating_{rating}'] for rating in range(1, 6)},
+    }
+
+def rebuild_rating_summaries(db):
+    """Recompute product_rating_summary from product_reviews."""
+    db.execute("DELETE FROM product_rating_summary")
+    db.execute("""
+        INSERT INTO product_rating_summary
+            (product_id, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+        SELECT product_id, count(*), sum(rating),
+               sum(rating = 1), sum(rating = 2), sum(rating = 3), sum(rating = 4), sum(rating = 5)
+        FROM product_reviews
+        GROUP BY product_id
+    """)
+
 def add_product_review(product_id, user_id, rating, comment):
-    """Add a new product review"""
+    """Add a new product review and fold it into the product's rating summary"""
     with get_db() as db:
         try:
             db.execute('''
                 INSERT INTO product_reviews (product_id, user_id, rating, comment)
                 VALUES (?, ?, ?, ?)
             ''', (product_id, user_id, rating, comment))
+            # The CHECK constraint above has already limited rating to 1-5.
+            bucket = f"rating_{int(rating)}"
+            db.execute(f'''
+                INSERT INTO product_rating_summary (product_id, review_count, rating_sum, {bucket})
+                VALUES (?, 1, ?, 1)
+                ON CONFLICT (product_id) DO UPDATE SET
+                    review_count = review_count + 1,
+                    rating_sum = rating_sum + excluded.rating_sum,
+                    {bucket} = {bucket} + 1
+            ''', (product_id, rating))
             db.commit()
             return True
         except sqlite3.Error as e:
             print(f"Error adding review: {e}")
             return False
 
-def search_products(search_query):
-    """Search for products by name or description"""
-    search_term = f"%{search_query}%"
+def search_page(page, total, per_page=SEARCH_PAGE_SIZE):
+    """The page search_products shows for a requested page and match count."""
+    return min(max(page, 1), max(-(-total // per_page), 1))
+
+def search_products(search_query, page=1, per_page=SEARCH_PAGE_SIZE):
+    """
+    Search products by name, brand and description, best matches first.
+    Returns (products on the requested page, total number of matches).
+    A page past the last one (or below 1) gives the last (or first) page;
+    search_page() says which that is.
+    """
+    match = _search_match_expression(search_query)
+    if not match:
+        return [], 0
     with get_db() as db:
+        total = db.execute(
+            "SELECT count(*) FROM products_fts WHERE products_fts MATCH ?", (match,)
+        ).fetchone()[0]
+        offset = (search_page(page, total, per_page) - 1) * per_page
         cursor = db.execute("""
-            SELECT p.*, c.name as category_name, c.slug as category_slug 
-            FROM products p
+            WITH hits AS (
+                SELECT rowid, rank FROM products_fts
+                WHERE products_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            )
+            SELECT p.*, c.name as category_name, c.slug as category_slug
+            FROM hits
+            JOIN products p ON p.id = hits.rowid
             JOIN categories c ON p.category_id = c.id
-            WHERE p.name LIKE ? OR p.description LIKE ?
-            ORDER BY p.name
-        """, (search_term, search_term))
-        return [dict(row) for row in cursor.fetchall()]
+            ORDER BY hits.rank
+        """, (match, per_page, offset))
+        return [dict(row) for row in cursor.fetchall()], total
 
 # User related functions
 def create_user(email, password_hash, full_name, address):
@@ -413,6 +1418,13 @@ def update_user_password(user_id, new_password_hash):
         db.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, user_id))
         db.commit()
 
+def replace_password_hash(user_id, old_password_hash, new_password_hash):
+    """Swap in a re-hashed password unless the password was changed meanwhile."""
+    with get_db() as db:
+        db.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                   (new_password_hash, user_id, old_password_hash))
+        db.commit()
+
 def get_all_users():
     with get_db() as db:
         rows = db.execute('SELECT * FROM users ORDER BY id').fetchall()
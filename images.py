@@ -0,0 +1,193 @@
+"""
+Product image renditions, produced off the request path on a process pool.
+Pillow and the pool are only imported once an image is actually processed,
+which keeps them out of the startup of every worker.
+"""
+import contextlib
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from werkzeug.utils import safe_join, secure_filename
+
+import database
+
+ORIGINALS_DIR = 'originals'
+RENDITIONS_DIR = 'renditions'
+
+# Rendition name -> longest edge in pixels. 'detail' also becomes the
+# product's main image, the 800px JPEG that used to be made in-request.
+RENDITIONS = {'thumb': 160, 'card': 400, 'detail': 800}
+RENDITION_FORMATS = {
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+MAX_WORKERS = 2
+
+# On-demand resizes are snapped to these widths, so arbitrary ?w= values
+# cannot fill the cache with near-duplicates.
+RESIZE_WIDTHS = (50, 100, 160, 320, 400, 800)
+RESIZE_MIMETYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp'}
+IMAGE_CACHE_DIR = 'cache/images'
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Source files whose digest is remembered
+SOURCE_DIGEST_CACHE_SIZE = 4096
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def rendition_filename(stem, name, ext='jpg'):
+    return f"{RENDITIONS_DIR}/{stem}_{name}.{ext}"
+
+def save_upload(image_file, upload_folder):
+    """
+    Store an uploaded file untouched under originals/.
+    Returns (filename relative to upload_folder, stem for its renditions).
+    """
+    original_filename = secure_filename(image_file.filename)
+    name, ext = os.path.splitext(original_filename)
+    stem = f"{name}_{int(time.time())}"
+    os.makedirs(os.path.join(upload_folder, ORIGINALS_DIR), exist_ok=True)
+    filename = f"{ORIGINALS_DIR}/{stem}{ext.lower()}"
+    image_file.save(os.path.join(upload_folder, filename))
+    return filename, stem
+
+def render_renditions(upload_folder, source, stem):
+    """
+    Decode the source once and write every rendition in every format.
+    Runs in a worker process. Returns (main image filename, rendition names).
+    """
+    from PIL import Image
+
+    largest = max(RENDITIONS.values())
+    with Image.open(os.path.join(upload_folder, source)) as img:
+        # For JPEGs this lets the decoder downscale by 1/2..1/8 for free.
+        img.draft('RGB', (largest, largest))
+        current = img.convert('RGB') if img.mode != 'RGB' else img.copy()
+    os.makedirs(os.path.join(upload_folder, RENDITIONS_DIR), exist_ok=True)
+    # Largest first, so each smaller size is resampled from the previous one.
+    for name, size in sorted(RENDITIONS.items(), key=lambda item: -item[1]):
+        current.thumbnail((size, size), Image.LANCZOS)
+        for ext, (fmt, options) in RENDITION_FORMATS.items():
+            current.save(os.path.join(upload_folder, rendition_filename(stem, name, ext)), fmt, **options)
+    main_image = f"{stem}.jpg"
+    shutil.copyfile(os.path.join(upload_folder, rendition_filename(stem, 'detail')),
+                    os.path.join(upload_folder, main_image))
+    return main_image, list(RENDITIONS)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _executor
+
+def _record_renditions(product_id, future):
+    try:
+        main_image, renditions = future.result()
+    except Exception as e:
+        # The product keeps pointing at its original upload.
+        print(f"Error processing image for product {product_id}: {e}")
+        return
+    database.set_product_image(product_id, main_image, renditions)
+
+def queue_renditions(product_id, upload_folder, source, stem):
+    """Render a product's images in the background and record them when done."""
+    future = _get_executor().submit(render_renditions, upload_folder, source, stem)
+    future.add_done_callback(lambda done: _record_renditions(product_id, done))
+    return future
+
+
+_image_cache_lock = threading.Lock()
+_image_cache_bytes = None
+
+# Keyed by (path, mtime, size) so a file is only hashed again after it changes.
+@functools.lru_cache(maxsize=SOURCE_DIGEST_CACHE_SIZE)
+def _file_digest(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _source_digest(path):
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+def snap_width(width):
+    """Smallest allowed width that is at least `width` (the largest if none is)."""
+    for allowed in RESIZE_WIDTHS:
+        if allowed >= width:
+            return allowed
+    return RESIZE_WIDTHS[-1]
+
+def resized_image(upload_folder, filename, width, ext='jpg'):
+    """
+    Path and strong ETag of `filename` resized to `width` pixels wide.
+    Results live in a content-addressed disk cache, so they are computed
+    once per source content, width and format. None if the source is missing.
+    """
+    source = safe_join(upload_folder, filename)
+    if source is None or not os.path.isfile(source):
+        return None
+    width = snap_width(width)
+    key = hashlib.sha256(f"{_source_digest(source)}:{width}:{ext}".encode()).hexdigest()
+    path = os.path.join(IMAGE_CACHE_DIR, key[:2], f"{key}.{ext}")
+    try:
+        # mtime doubles as the last-used time for LRU eviction.
+        os.utime(path)
+        return path, key
+    except FileNotFoundError:
+        pass
+
+    from PIL import Image
+
+    fmt, options = RENDITION_FORMATS[ext]
+    with Image.open(source) as img:
+        img.draft('RGB', (width, width))
+        img = img.convert('RGB') if img.mode != 'RGB' else img.copy()
+    img.thumbnail((width, img.height), Image.LANCZOS)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        img.save(f, fmt, **options)
+    os.replace(tmp_path, path)
+    _account_cached_file(path)
+    return path, key
+
+def _cached_files():
+    for root, _, files in os.walk(IMAGE_CACHE_DIR):
+        for name in files:
+            # Another thread's resize still being written
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+def _account_cached_file(new_path):
+    global _image_cache_bytes
+    size = os.path.getsize(new_path)
+    with _image_cache_lock:
+        if _image_cache_bytes is None:
+            _image_cache_bytes = sum(size for _, size, _ in _cached_files())
+        else:
+            _image_cache_bytes += size
+        if _image_cache_bytes <= IMAGE_CACHE_MAX_BYTES:
+            return
+        # Evict least recently used files down to 90% of the limit, but
+        # never the file that is about to be served.
+        target = IMAGE_CACHE_MAX_BYTES * 0.9
+        total = 0
+        for _, size, path in sorted(_cached_files(), reverse=True):
+            total += size
+            if total > target and path != new_path:
+                # Another worker process may have evicted it already
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+        _image_cache_bytes = total
@@ -0,0 +1,245 @@
+"""
+Bulk product import from a supplier feed (CSV with a header row, or JSONL).
+
+    python importer.py feed.csv --images-dir supplier/images
+
+Each record needs slug, name, price and category (a category slug) and may
+have description, brand, stock_quantity and image (a file path, relative
+to --images-dir). The feed is read as a stream and written in batches, each
+batch upserting its products by slug in one transaction, so a feed can be
+re-imported to update prices and stock. Changed images are rendered on the
+images.py process pool.
+
+After every batch a checkpoint with the last imported line is written next
+to the feed; running the same import again after a failure continues from
+there (--restart ignores it). Upserts and image names are deterministic, so
+redoing a partly imported batch is harmless.
+"""
+import argparse
+import codecs
+import csv
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+import database
+import images
+
+UPLOAD_FOLDER = 'static/images/products'
+BATCH_SIZE = 500
+# Image jobs allowed in flight before reading more of the feed
+MAX_PENDING_IMAGES = images.MAX_WORKERS * 8
+MAX_REPORTED_ERRORS = 100
+
+def iter_feed(stream, fmt):
+    """
+    Yield (line number, record dict) from a binary stream, one record at a
+    time; the record is None for a line that is not a JSON object.
+    """
+    text = codecs.getreader('utf-8-sig')(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield line_number, record if isinstance(record, dict) else None
+
+def feed_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def _product_row(record, category_ids):
+    """Validate a feed record; returns a row for database.upsert_products or raises ValueError."""
+    slug = (record.get('slug') or '').strip()
+    name = (record.get('name') or '').strip()
+    category_slug = (record.get('category') or '').strip()
+    if not slug or not name:
+        raise ValueError('Brak pola slug lub name.')
+    if category_slug not in category_ids:
+        raise ValueError(f'Nieznana kategoria: {category_slug}')
+    try:
+        price = round(float(record.get('price')), 2)
+        stock_quantity = int(record.get('stock_quantity') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Nieprawidłowa cena lub ilość.') from None
+    if price < 0 or stock_quantity < 0:
+        raise ValueError('Cena i ilość nie mogą być ujemne.')
+    return {
+        'slug': slug,
+        'name': name,
+        'price': price,
+        # The listing templates truncate it, so never NULL
+        'description': record.get('description') or '',
+        'category_id': category_ids[category_slug],
+        'brand': (record.get('brand') or '').strip() or None,
+        'stock_quantity': stock_quantity,
+        'image': None,
+    }
+
+def _stage_image(source, slug, existing_image, upload_folder):
+    """
+    Copy a feed image into originals/ unless the product already uses it.
+    Returns (filename relative to upload_folder, stem) or None if unchanged.
+    The stem comes from the slug and the file content, so the same image
+    always gets the same name.
+    """
+    stem = f"{secure_filename(slug)}_{images._source_digest(source)[:12]}"
+    if existing_image and os.path.basename(existing_image).startswith(stem):
+        return None
+    filename = f"{images.ORIGINALS_DIR}/{stem}{os.path.splitext(source)[1].lower()}"
+    os.makedirs(os.path.join(upload_folder, images.ORIGINALS_DIR), exist_ok=True)
+    shutil.copyfile(source, os.path.join(upload_folder, filename))
+    return filename, stem
+
+def read_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_checkpoint(path, checkpoint):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def import_feed(stream, fmt='csv', images_dir=None, upload_folder=UPLOAD_FOLDER, batch_size=BATCH_SIZE,
+                checkpoint_path=None, wait_for_images=True, progress=None):
+    """
+    Import a feed from a binary stream. Returns a report dict with counts,
+    errors (line, message) and throughput. With checkpoint_path, lines up
+    to the checkpoint are skipped and the checkpoint advances per batch; it
+    is removed once the whole feed is in. progress(report) is called after
+    every batch. Image paths are only accepted inside images_dir; without
+    one, records with an image fail.
+    """
+    started = time.perf_counter()
+    category_ids = {category['slug']: category['id'] for category in database.get_categories()}
+    checkpoint = read_checkpoint(checkpoint_path) if checkpoint_path else None
+    resume_after = checkpoint['line'] if checkpoint else 0
+    report = {'read': 0, 'skipped': 0, 'created': 0, 'updated': 0, 'failed': 0,
+              'images_queued': 0, 'images_failed': 0, 'errors': [], 'resumed_after_line': resume_after}
+    pending_images = set()
+
+    def fail(line_number, message):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append((line_number, message))
+
+    def flush(batch):
+        existing = database.get_products_by_slugs([row['slug'] for row, _, _ in batch])
+        staged = {}
+        rows = []
+        for row, source, line_number in batch:
+            if source is not None:
+                # Feed paths must stay inside images_dir (no absolute or ../ paths)
+                path = safe_join(images_dir, source) if images_dir else None
+                if path is None:
+                    fail(line_number, f'Niedozwolona ścieżka obrazu: {source}')
+                    continue
+                if not os.path.isfile(path):
+                    fail(line_number, f'Brak pliku obrazu: {source}')
+                    continue
+                current = existing.get(row['slug'], {}).get('image')
+                image = _stage_image(path, row['slug'], current, upload_folder)
+                if image is not None:
+                    row['image'] = image[0]
+                    staged[row['slug']] = image
+            rows.append(row)
+        for row in rows:
+            # A new product needs some image until its renditions are ready
+            if row['image'] is None and row['slug'] not in existing:
+                row['image'] = ''
+        product_ids = database.upsert_products(rows) if rows else {}
+        report['created'] += sum(1 for row in rows if row['slug'] not in existing)
+        report['updated'] += sum(1 for row in rows if row['slug'] in existing)
+        for slug, (filename, stem) in staged.items():
+            while len(pending_images) >= MAX_PENDING_IMAGES:
+                done, _ = wait(pending_images, return_when=FIRST_COMPLETED)
+                pending_images.difference_update(done)
+            pending_images.add(images.queue_renditions(product_ids[slug], upload_folder, filename, stem))
+            report['images_queued'] += 1
+        if checkpoint_path:
+            _write_checkpoint(checkpoint_path, {'line': batch[-1][2]})
+        if progress:
+            progress(_with_throughput(report, started))
+
+    batch = []
+    try:
+        for line_number, record in iter_feed(stream, fmt):
+            if line_number <= resume_after:
+                report['skipped'] += 1
+                continue
+            report['read'] += 1
+            if record is None:
+                fail(line_number, 'Nieprawidłowy rekord JSON.')
+                continue
+            try:
+                row = _product_row(record, category_ids)
+            except ValueError as e:
+                fail(line_number, str(e))
+                continue
+            batch.append((row, (record.get('image') or '').strip() or None, line_number))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        # Images of the batches already committed are finished even if a
+        # later batch failed, since the checkpoint has moved past them.
+        if wait_for_images and pending_images:
+            done, _ = wait(pending_images)
+            report['images_failed'] = sum(1 for future in done if future.exception() is not None)
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return _with_throughput(report, started)
+
+def _with_throughput(report, started):
+    elapsed = time.perf_counter() - started
+    imported = report['created'] + report['updated']
+    return {**report, 'seconds': round(elapsed, 2),
+            'products_per_s': round(imported / elapsed, 1) if elapsed else None}
+
+def main():
+    parser = argparse.ArgumentParser(description='Import products from a CSV or JSONL feed.')
+    parser.add_argument('feed')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='default: from the file extension')
+    parser.add_argument('--images-dir', help='directory the feed image paths are relative to')
+    parser.add_argument('--upload-folder', default=UPLOAD_FOLDER)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--database', default=database.DATABASE)
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint of an earlier run')
+    args = parser.parse_args()
+
+    database.DATABASE = args.database
+    database.init_db()
+    checkpoint_path = args.feed + '.checkpoint'
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    def progress(report):
+        print(f"  {report['created']} created, {report['updated']} updated, {report['failed']} failed, "
+              f"{report['images_queued']} images queued ({report['products_per_s']} products/s)", flush=True)
+
+    with open(args.feed, 'rb') as stream:
+        report = import_feed(stream, args.format or feed_format(args.feed), args.images_dir, args.upload_folder,
+                             args.batch_size, checkpoint_path, progress=progress)
+    for line_number, message in report['errors']:
+        print(f"  line {line_number}: {message}", file=sys.stderr)
+    print(json.dumps({key: value for key, value in report.items() if key != 'errors'}, indent=2))
+
+if __name__ == '__main__':
+    main()
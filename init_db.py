@@ -1,94 +1,32 @@
+import argparse
+import itertools
 import os
+import random
 import sqlite3
+import time
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash
 
+import database
+
 def init_database():
-    # Remove existing database if it exists
-    if os.path.exists('store.db'):
-        os.remove('store.db')
+    """
+    Recreate store.db with the sample data. Stop the app first: its pooled
+    connections keep the database and its WAL open, and resetting the file
+    underneath them fails with "disk I/O error".
+    """
+    # Remove existing database (and its WAL and shared-memory files) if it exists
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('store.db' + suffix):
+            os.remove('store.db' + suffix)
     
-    # Connect to the database (this will create it)
+    # Connect to the database (this will create it) and create the core
+    # tables; the rest of the schema is built over the sample data below
     conn = sqlite3.connect('store.db')
+    conn.row_factory = sqlite3.Row
+    database.migrate(conn, target=1)
     cursor = conn.cursor()
     
-    # Create tables
-    cursor.executescript('''
-    -- Users table
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT NOT NULL UNIQUE,
-        password_hash TEXT NOT NULL,
-        full_name TEXT,
-        address TEXT,
-        is_admin BOOLEAN NOT NULL DEFAULT 0
-    );
-
-    -- Categories table
-    CREATE TABLE IF NOT EXISTS categories (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL UNIQUE,
-        slug TEXT NOT NULL UNIQUE
-    );
-    
-    -- Products table
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        price DECIMAL(10,2) NOT NULL,
-        description TEXT,
-        image TEXT,
-        category_id INTEGER,
-        brand TEXT,
-        stock_quantity INTEGER NOT NULL DEFAULT 0,
-        slug TEXT UNIQUE,
-        date_added TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (category_id) REFERENCES categories (id)
-    );
-    
-    -- Orders table
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        order_date TEXT DEFAULT CURRENT_TIMESTAMP,
-        total_amount DECIMAL(10,2) NOT NULL,
-        status TEXT NOT NULL,
-        shipping_address TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    );
-    
-    -- Order Items table
-    CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL,
-        unit_price DECIMAL(10,2) NOT NULL,
-        FOREIGN KEY (order_id) REFERENCES orders (id),
-        FOREIGN KEY (product_id) REFERENCES products (id)
-    );
-    
-    -- Product Reviews table
-    CREATE TABLE IF NOT EXISTS product_reviews (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        product_id INTEGER NOT NULL,
-        user_id INTEGER NOT NULL,
-        rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-        comment TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (product_id) REFERENCES products (id),
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    );
-    
-    -- Create indexes
-    CREATE INDEX IF NOT EXISTS idx_products_category_id ON products (category_id);
-    CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id);
-    CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);
-    CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id);
-    CREATE INDEX IF NOT EXISTS idx_product_reviews_product_id ON product_reviews (product_id);
-    CREATE INDEX IF NOT EXISTS idx_product_reviews_user_id ON product_reviews (user_id);
-    CREATE INDEX IF NOT EXISTS idx_products_slug ON products (slug);
-    ''')
-    
     # Insert sample categories
     categories = [
         ('Aparaty', 'aparaty'),
@@ -147,10 +85,189 @@ def init_database():
         VALUES (?, ?, ?, ?)
     ''', reviews)
     
-    # Commit changes and close connection
+    # Commit changes, close connection and finish the schema
     conn.commit()
     conn.close()
+    database.DATABASE = 'store.db'
+    database.init_db()
     print("Database initialized successfully!")
 
+# Synthetic data generator
+ORDER_STATUSES = ['nowe', 'W realizacji', 'Wysłane', 'Zrealizowane', 'Anulowane']
+STATUS_WEIGHTS = [5, 5, 10, 75, 5]
+RATING_WEIGHTS = [5, 5, 10, 30, 50]  # 1..5 stars
+WORDS = [
+    'aparat', 'obiektyw', 'lustrzanka', 'bezlusterkowiec', 'statyw', 'lampa', 'dron',
+    'gimbal', 'filtr', 'torba', 'karta', 'pamięci', 'mikrofon', 'monitor', 'drukarka',
+    'pełnoklatkowy', 'profesjonalny', 'kompaktowy', 'studyjny', 'szerokokątny', 'jasny',
+    'stabilizacja', 'matryca', 'migawka', 'ogniskowa', 'zoom', 'makro', 'portretowy',
+]
+BRANDS = ['Canon', 'Sony', 'Nikon', 'Fujifilm', 'Panasonic', 'DJI', 'Leica', 'Olympus', 'Sigma', 'Tamron']
+IMAGES = sorted(os.listdir('static/images/products')) if os.path.isdir('static/images/products') else []
+
+def _zipf_cum_weights(n, exponent=1.1):
+    """Cumulative weights that make a few ids very popular (hot products, heavy buyers)."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+def _skewed_ids(rng, n, exponent=1.1):
+    """Endless stream of ids 1..n with Zipf-like popularity, hot ids spread out randomly."""
+    ids = list(range(1, n + 1))
+    rng.shuffle(ids)
+    cum_weights = _zipf_cum_weights(n, exponent)
+    while True:
+        yield from rng.choices(ids, cum_weights=cum_weights, k=10000)
+
+def _batched(rows, size):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _load(conn, label, sql, rows, batch_size):
+    """executemany in large transactions, reporting rows/s."""
+    start = time.perf_counter()
+    count = 0
+    for batch in _batched(rows, batch_size):
+        conn.executemany(sql, batch)
+        conn.commit()
+        count += len(batch)
+    elapsed = time.perf_counter() - start
+    print(f"  {label}: {count} rows in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)")
+
+def generate_database(path='store.db', categories=20, products=100000, users=50000, orders=500000,
+                      reviews=200000, seed=1, batch_size=100000):
+    """
+    Build a database of synthetic, realistically skewed data at path.
+    Only the core tables exist while they are bulk-loaded; the remaining
+    migrations (indexes, triggers, search index, summaries) run once at the
+    end, through database.init_db().
+    Leaves database.DATABASE pointing at path.
+    """
+    started = time.perf_counter()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        PRAGMA locking_mode = EXCLUSIVE;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA cache_size = -200000;
+    ''')
+    conn.row_factory = sqlite3.Row
+    database.migrate(conn, target=1)
+    print(f"Generating {path}:")
+
+    _load(conn, 'categories', 'INSERT INTO categories (id, name, slug) VALUES (?, ?, ?)',
+          ((i, f'Kategoria {i}', f'kategoria-{i}') for i in range(1, categories + 1)), batch_size)
+
+    # A few categories hold most of the catalog.
+    category_ids = _skewed_ids(rng, categories, exponent=0.8)
+    start_date = datetime(2023, 1, 1)
+    prices = [0.0] * (products + 1)
+
+    def product_rows():
+        for i in range(1, products + 1):
+            brand = rng.choice(BRANDS)
+            price = prices[i] = round(min(rng.lognormvariate(7, 1.2), 60000) + 10, 2)
+            added = start_date + timedelta(minutes=rng.randrange(0, 3 * 365 * 24 * 60))
+            yield (i, f"{brand} {rng.choice(WORDS)} {i}", price, ' '.join(rng.choices(WORDS, k=15)),
+                   rng.choice(IMAGES) if IMAGES else None, next(category_ids), brand,
+                   rng.randint(0, 100), f'produkt-{i}', added.strftime('%Y-%m-%d %H:%M:%S'))
+
+    _load(conn, 'products', '''
+        INSERT INTO products (id, name, price, description, image, category_id, brand, stock_quantity, slug, date_added)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', product_rows(), batch_size)
+
+    # Hashing is deliberately slow, so every synthetic user shares one (password: user123).
+    password_hash = generate_password_hash('user123')
+    _load(conn, 'users', '''
+        INSERT INTO users (id, email, password_hash, full_name, address, is_admin) VALUES (?, ?, ?, ?, ?, 0)
+    ''', ((i, f'user{i}@example.com', password_hash, f'Użytkownik {i}', f'ul. Testowa {i}\nWarszawa')
+          for i in range(1, users + 1)), batch_size)
+
+    buyer_ids = _skewed_ids(rng, users, exponent=1.0)
+    hot_product_ids = _skewed_ids(rng, products)
+    items = []
+
+    def order_rows():
+        item_id = 0
+        for order_id in range(1, orders + 1):
+            total = 0
+            for product_id in {next(hot_product_ids) for _ in range(rng.choices((1, 2, 3, 4), (60, 25, 10, 5))[0])}:
+                quantity = rng.choices((1, 2, 3), (85, 12, 3))[0]
+                item_id += 1
+                items.append((item_id, order_id, product_id, quantity, prices[product_id]))
+                total += quantity * prices[product_id]
+            ordered = start_date + timedelta(seconds=rng.randrange(0, 3 * 365 * 24 * 3600))
+            yield (order_id, next(buyer_ids), ordered.strftime('%Y-%m-%d %H:%M:%S'), round(total, 2),
+                   rng.choices(ORDER_STATUSES, STATUS_WEIGHTS)[0], 'Synthetic\nAddress')
+
+    def item_rows():
+        # Drained batch by batch so items never pile up for the whole load.
+        while items:
+            batch, items[:] = items[:], []
+            yield from batch
+
+    order_sql = '''
+        INSERT INTO orders (id, user_id, order_date, total_amount, status, shipping_address)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    item_sql = '''
+        INSERT INTO order_items (id, order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)
+    '''
+    load_start = time.perf_counter()
+    order_count = item_count = 0
+    for batch in _batched(order_rows(), batch_size):
+        conn.executemany(order_sql, batch)
+        pending = list(item_rows())
+        conn.executemany(item_sql, pending)
+        conn.commit()
+        order_count += len(batch)
+        item_count += len(pending)
+    elapsed = time.perf_counter() - load_start
+    print(f"  orders + order_items: {order_count} + {item_count} rows in {elapsed:.1f}s "
+          f"({(order_count + item_count) / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    reviewed_product_ids = _skewed_ids(rng, products)
+    _load(conn, 'product_reviews', '''
+        INSERT INTO product_reviews (product_id, user_id, rating, comment, created_at) VALUES (?, ?, ?, ?, ?)
+    ''', ((next(reviewed_product_ids), rng.randint(1, users), rng.choices((1, 2, 3, 4, 5), RATING_WEIGHTS)[0],
+           ' '.join(rng.choices(WORDS, k=12)),
+           (start_date + timedelta(seconds=rng.randrange(0, 3 * 365 * 24 * 3600))).strftime('%Y-%m-%d %H:%M:%S'))
+          for _ in range(reviews)), batch_size)
+
+    index_start = time.perf_counter()
+    conn.close()
+    database.DATABASE = path
+    database.close_db_connections()
+    database.init_db()
+    with database.get_db() as db:
+        db.execute('ANALYZE')
+        db.commit()
+    print(f"  indexes, search index and summaries: {time.perf_counter() - index_start:.1f}s")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
 if __name__ == '__main__':
-    init_database()
+    parser = argparse.ArgumentParser(description='Create store.db with sample data, or a large synthetic one. '
+                                                 'Stop the app before resetting its database.')
+    parser.add_argument('--generate', action='store_true', help='generate synthetic data instead of the sample data')
+    parser.add_argument('--database', default='store.db')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--orders', type=int, default=500000)
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=100000)
+    args = parser.parse_args()
+    if args.generate:
+        generate_database(args.database, args.categories, args.products, args.users, args.orders,
+                          args.reviews, args.seed, args.batch_size)
+    else:
+        init_database()
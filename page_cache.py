@@ -0,0 +1,110 @@
+"""
+In-process cache of rendered catalog pages for anonymous visitors.
+
+Entries are keyed by path and the normalized query parameters the page
+actually reads, and remember the ETag they were rendered under (see
+app.page_validators). A hit is only served while that ETag is still
+current, so changes made by other processes are never served stale; the
+write paths in app.py additionally drop the affected entries by tag.
+"""
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 2000
+MAX_BYTES = 64 * 1024 * 1024
+
+# Query parameters each cached endpoint reads. Anything else (tracking
+# parameters and the like) does not split the cache.
+CACHED_PARAMS = {
+    'home': (),
+    'category_page': ('sort', 'brand', 'price_min', 'price_max', 'cursor'),
+    'product_detail': ('reviews_page',),
+}
+
+_entries = OrderedDict()  # key -> (etag, body, tags)
+_tagged = {}              # tag -> keys of the entries carrying it
+_size = 0
+_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'invalidated': 0, 'evicted': 0}
+_lock = threading.Lock()
+
+def cached_args(endpoint, args):
+    """
+    The parameters make_key covers, normalized as it does: {name: sorted
+    values}. Links on a cached page must be built from these alone, or
+    they would carry whatever else the first visitor's URL had.
+    """
+    params = {}
+    for name in CACHED_PARAMS[endpoint]:
+        values = sorted({value for value in args.getlist(name) if value})
+        if values:
+            params[name] = values
+    return params
+
+def make_key(endpoint, path, args):
+    """Cache key for a request; repeated and reordered parameters collapse."""
+    params = cached_args(endpoint, args)
+    return path, tuple((name, tuple(params.get(name, ()))) for name in CACHED_PARAMS[endpoint])
+
+def _remove(key):
+    global _size
+    etag, body, tags = _entries.pop(key)
+    _size -= len(body)
+    for tag in tags:
+        keys = _tagged.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _tagged[tag]
+
+def get(key, etag):
+    """The cached body for key if it was rendered under etag, else None."""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats['misses'] += 1
+            return None
+        if entry[0] != etag:
+            _remove(key)
+            _stats['stale'] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats['hits'] += 1
+        return entry[1]
+
+def put(key, etag, body, tags):
+    global _size
+    if len(body) > MAX_BYTES:
+        return
+    with _lock:
+        if key in _entries:
+            _remove(key)
+        _entries[key] = (etag, body, tuple(tags))
+        _size += len(body)
+        for tag in tags:
+            _tagged.setdefault(tag, set()).add(key)
+        while len(_entries) > MAX_ENTRIES or _size > MAX_BYTES:
+            _remove(next(iter(_entries)))
+            _stats['evicted'] += 1
+
+def invalidate(*tags):
+    """Drop every entry carrying any of the tags ('product:<id>', 'category:<id>', 'catalog')."""
+    with _lock:
+        for tag in tags:
+            for key in list(_tagged.get(tag, ())):
+                _remove(key)
+                _stats['invalidated'] += 1
+
+def clear():
+    with _lock:
+        for key in list(_entries):
+            _remove(key)
+
+def get_stats():
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses'] + _stats['stale']
+        return {
+            **_stats,
+            'entries': len(_entries),
+            'bytes': _size,
+            'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else None,
+        }
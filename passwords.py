@@ -0,0 +1,121 @@
+"""
+Password hashing on a bounded thread pool.
+
+hashlib's PBKDF2 and scrypt release the GIL, so hashes really run in
+parallel on threads. The pool caps how many run at once, so a login spike
+queues up here instead of taking every core away from the other requests,
+and a full queue turns new logins away instead of piling up.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import database
+
+# werkzeug method string, e.g. 'pbkdf2:sha256:260000' or 'scrypt:32768:8:1'.
+# Hashes made with any other method are re-made with this one on login.
+METHOD = os.environ.get('STORE_PASSWORD_METHOD', 'pbkdf2:sha256:260000')
+SALT_LENGTH = 16
+MAX_WORKERS = int(os.environ.get('STORE_PASSWORD_WORKERS', 0)) or os.cpu_count() or 1
+# Hashes allowed to wait for a worker; callers beyond that wait up to
+# WAIT_TIMEOUT seconds for room and are then refused.
+MAX_PENDING = MAX_WORKERS * 16
+WAIT_TIMEOUT = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_method_prefix = None
+
+def configure(method=None, workers=None):
+    """Change the policy or pool size (for benchmarks); running hashes finish on the old pool."""
+    global METHOD, MAX_WORKERS, MAX_PENDING, _executor, _slots, _method_prefix
+    with _executor_lock:
+        if method is not None:
+            METHOD = method
+            _method_prefix = None
+        if workers is not None:
+            MAX_WORKERS = workers
+            MAX_PENDING = workers * 16
+            _slots = threading.BoundedSemaphore(MAX_PENDING)
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='passwords')
+        return _executor
+
+def _submit(func, *args, wait=True):
+    """Run func on the pool. Returns its future, or None if wait=False and the pool is full."""
+    slots = _slots
+    if not slots.acquire(timeout=WAIT_TIMEOUT if wait else 0):
+        if not wait:
+            return None
+        raise Exception('Serwer jest przeciążony, spróbuj ponownie za chwilę.')
+    try:
+        future = _get_executor().submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+def _hash(password):
+    return generate_password_hash(password, METHOD, SALT_LENGTH)
+
+def hash_password(password):
+    """Hash a password with the current policy."""
+    return _submit(_hash, password).result()
+
+def verify_password(stored_hash, password):
+    return _submit(check_password_hash, stored_hash, password).result()
+
+async def verify_password_async(stored_hash, password):
+    """verify_password for async views: awaits the pool and fails at once when it is full."""
+    future = _submit(check_password_hash, stored_hash, password, wait=False)
+    if future is None:
+        raise Exception('Serwer jest przeciążony, spróbuj ponownie za chwilę.')
+    return await asyncio.wrap_future(future)
+
+def needs_rehash(stored_hash):
+    """Whether a stored hash was made with a method or cost other than the current policy."""
+    global _method_prefix
+    if _method_prefix is None:
+        # werkzeug fills in defaults ('pbkdf2:sha256' -> 'pbkdf2:sha256:<n>'),
+        # so compare with what it actually writes.
+        _method_prefix = generate_password_hash('', METHOD, SALT_LENGTH).split('$', 1)[0]
+    return stored_hash.split('$', 1)[0] != _method_prefix
+
+def rehash_in_background(user, password):
+    """
+    After a successful login, re-hash the password with the current policy
+    without delaying the response. Skipped when the pool is busy; the next
+    login will try again.
+    """
+    # The first needs_rehash() hashes to learn the policy's prefix, so
+    # until that is known the check itself runs on the pool.
+    if _method_prefix is not None and not needs_rehash(user['password_hash']):
+        return
+    future = _submit(_rehash, user['password_hash'], password, wait=False)
+    if future is not None:
+        future.add_done_callback(lambda done: _store_rehash(user, done))
+
+def _rehash(stored_hash, password):
+    return _hash(password) if needs_rehash(stored_hash) else None
+
+def _store_rehash(user, future):
+    try:
+        new_hash = future.result()
+    except Exception as e:
+        print(f"Error rehashing password for user {user['id']}: {e}")
+        return
+    if new_hash is None:
+        return
+    database.replace_password_hash(user['id'], user['password_hash'], new_hash)
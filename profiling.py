@@ -0,0 +1,135 @@
+"""
+Opt-in request instrumentation, switched on with STORE_PROFILING=1.
+
+When enabled it times every route and every public database.py function,
+counts queries per request, logs queries slower than STORE_SLOW_QUERY_MS
+together with their parameters and EXPLAIN QUERY PLAN, and writes a cProfile
+dump for a STORE_PROFILE_SAMPLE_RATE fraction of requests into
+STORE_PROFILE_DIR. When disabled nothing is installed at all, so the normal
+code paths run exactly as before.
+"""
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import random
+import sqlite3
+import time
+
+from flask import g, has_request_context, request
+
+import database
+
+ENABLED = os.environ.get('STORE_PROFILING') == '1'
+SLOW_QUERY_MS = float(os.environ.get('STORE_SLOW_QUERY_MS', 50))
+PROFILE_SAMPLE_RATE = float(os.environ.get('STORE_PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('STORE_PROFILE_DIR', 'profiles')
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+logger = logging.getLogger('store.profiling')
+
+def _request_stats():
+    if has_request_context() and 'profile' in g:
+        return g.profile
+    return None
+
+class ProfilingConnection(sqlite3.Connection):
+    """
+    Connection that times execute()/executemany(). The time covers running
+    the statement up to its first row, which for sorts and aggregates is
+    nearly all of the work.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, None, time.perf_counter() - start)
+
+    def _record(self, sql, parameters, elapsed):
+        stats = _request_stats()
+        if stats is not None:
+            stats['queries'] += 1
+            stats['query_time'] += elapsed
+        if elapsed * 1000 < SLOW_QUERY_MS:
+            return
+        plan = ''
+        if parameters is not None and sql.lstrip().upper().startswith(EXPLAINABLE):
+            try:
+                rows = super().execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+                plan = '\n'.join(f"  {row[3]}" for row in rows)
+            except sqlite3.Error as e:
+                plan = f"  (no plan: {e})"
+        logger.warning("Slow query (%.1f ms): %s\n  params: %r\n%s",
+                       elapsed * 1000, ' '.join(sql.split()), parameters, plan)
+
+def _timed(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = _request_stats()
+        if stats is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            calls = stats['db_calls'].setdefault(name, [0, 0.0])
+            calls[0] += 1
+            calls[1] += time.perf_counter() - start
+    return wrapper
+
+def _instrument_database():
+    database.connection_factory = ProfilingConnection
+    for name, func in list(vars(database).items()):
+        if (inspect.isfunction(func) and func.__module__ == database.__name__
+                and not name.startswith('_') and name != 'get_db'):
+            setattr(database, name, _timed(name, func))
+
+def _before_request():
+    g.profile = {'start': time.perf_counter(), 'queries': 0, 'query_time': 0.0, 'db_calls': {}}
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _after_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{os.getpid()}.prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+    stats = g.profile
+    total = time.perf_counter() - stats['start']
+    calls = ', '.join(
+        f"{name} {count}x {elapsed * 1000:.1f}ms"
+        for name, (count, elapsed) in sorted(stats['db_calls'].items(), key=lambda item: -item[1][1])
+    )
+    logger.info("%s %s %s %.1fms queries=%d (%.1fms) %s",
+                request.method, request.full_path.rstrip('?'), response.status_code,
+                total * 1000, stats['queries'], stats['query_time'] * 1000, calls)
+    response.headers['Server-Timing'] = (
+        f"db;dur={stats['query_time'] * 1000:.1f};desc=\"{stats['queries']} queries\", "
+        f"app;dur={total * 1000:.1f}"
+    )
+    return response
+
+def init_app(app):
+    """Install the instrumentation on app and database.py if STORE_PROFILING=1."""
+    if not ENABLED:
+        return
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    _instrument_database()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
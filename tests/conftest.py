@@ -0,0 +1,30 @@
+import pytest
+
+import database
+from init_db import generate_database
+
+@pytest.fixture(scope='session')
+def store_db(tmp_path_factory):
+    """A small synthetic store; the app is only imported once it points here."""
+    path = str(tmp_path_factory.mktemp('store') / 'store.db')
+    generate_database(path, categories=3, products=60, users=100, orders=40, reviews=50, seed=1)
+    return path
+
+@pytest.fixture
+def app(store_db):
+    database.DATABASE = store_db
+    from app import app
+    app.config['TESTING'] = True
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def admin_client(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['user_email'] = 'admin@example.com'
+        session['is_admin'] = True
+    return client
@@ -0,0 +1,35 @@
+import base64
+import json
+
+import pytest
+
+import database
+
+def make_token(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def test_cursor_round_trip():
+    token = database.encode_cursor(['2024-01-02 10:00:00', 7])
+    assert database.decode_cursor(token, 2) == ['2024-01-02 10:00:00', 7]
+
+@pytest.mark.parametrize('values', [
+    [['2024-01-01'], 7],
+    ['2024-01-01', {'id': 7}],
+    ['2024-01-01', '7'],
+    ['2024-01-01', 7.5],
+    ['2024-01-01', True],
+    ['2024-01-01'],
+    {'order_date': '2024-01-01', 'id': 7},
+])
+def test_malformed_cursor_is_ignored(values):
+    assert database.decode_cursor(make_token(values), 2) is None
+
+def test_malformed_cursor_gives_first_orders_page(admin_client):
+    newest = database.get_orders_page()[0][0]
+    response = admin_client.get('/admin/orders?cursor=' + make_token([['2024-01-01'], {'id': 1}]))
+    assert response.status_code == 200
+    assert f"/admin/orders/{newest['id']}".encode() in response.data
+
+def test_malformed_cursor_gives_first_category_page(client):
+    response = client.get('/kategoria-1?cursor=' + make_token(['newest', [1], {'id': 1}]))
+    assert response.status_code == 200
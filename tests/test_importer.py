@@ -0,0 +1,16 @@
+import io
+
+import database
+import importer
+
+def test_row_without_description_lists_in_its_category(client):
+    feed = io.BytesIO(b'slug,name,price,category\n'
+                      b'bez-opisu,Statyw bez opisu,999999,kategoria-1\n')
+    report = importer.import_feed(feed, 'csv')
+    assert report['created'] == 1 and report['failed'] == 0
+    assert database.get_product_by_id_or_slug('bez-opisu')['description'] == ''
+
+    # The most expensive product, so it is on the first page
+    response = client.get('/kategoria-1?sort=price_desc')
+    assert response.status_code == 200
+    assert 'Statyw bez opisu' in response.get_data(as_text=True)